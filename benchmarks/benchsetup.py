@@ -0,0 +1,58 @@
+'''
+Django setup shared by the benchmarks: an in memory sqlite database with the
+notification tables, and a small timing helper.
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        INSTALLED_APPS=["django.contrib.auth", "django.contrib.contenttypes",
+                        "django.contrib.sites", "notification"],
+        SITE_ID=1,
+        USE_TZ=True,
+        EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    )
+
+
+def setup():
+    '''
+    Creates the tables, returns nothing.
+    '''
+    from django.core.management import call_command
+    call_command("syncdb", interactive=False, verbosity=0)
+
+
+def create_users(n, prefix="user"):
+    '''
+    Creates n users and returns them.
+    '''
+    from django.contrib.auth.models import User
+    User.objects.bulk_create([User(username="%s%d" % (prefix, i),
+                                   email="%s%d@example.com" % (prefix, i))
+                              for i in xrange(n)])
+    return list(User.objects.filter(username__startswith=prefix).order_by("pk"))
+
+
+def best(func, repeat=5, number=1):
+    '''
+    Returns the best time of func in milliseconds over repeat runs.
+    '''
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+
+
+def table(header, rows):
+    '''
+    Prints rows (lists of values) aligned under header.
+    '''
+    rows = [header] + [[isinstance(value, float) and "%.2f" % value or str(value)
+                        for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print "  ".join(value.rjust(width) for value, width in zip(row, widths))
@@ -0,0 +1,47 @@
+'''
+Wall time of a send through slow backends (simulated network latency per
+chunk) delivered one backend after the other against
+notification.delivery's thread pool.
+'''
+import time
+
+from benchsetup import best, table
+
+from notification import delivery
+from notification.models import NoticeType
+
+
+class LatencyBackend(object):
+    concurrent = True
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def deliver_many(self, recipients, sender, notice_type, shared_context, per_user_context):
+        time.sleep(self.latency)
+
+
+def main():
+    notice_type = NoticeType(label="comment")
+    backends = [("email", LatencyBackend(0.05)), ("sms", LatencyBackend(0.02)),
+                ("website", LatencyBackend(0.005))]
+    rows = []
+    for n in (100, 1000):
+        recipients = range(n)
+
+        def sequential():
+            for label, backend in backends:
+                for i in xrange(0, n, delivery.CHUNK_SIZE):
+                    backend.deliver_many(recipients[i:i + delivery.CHUNK_SIZE], None,
+                                         notice_type, {}, {})
+
+        def concurrent():
+            delivery.deliver([(label, backend, recipients) for label, backend in backends],
+                             None, notice_type, {}, {})
+
+        rows.append([n, best(sequential, repeat=3), best(concurrent, repeat=3)])
+    table(["recipients", "sequential ms", "concurrent ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
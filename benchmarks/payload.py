@@ -0,0 +1,41 @@
+'''
+Size and encode/decode time of a queued batch (NoticeQueueBatch.pickled_data)
+in the version 2 payload format against the version 1 pickle.
+'''
+from benchsetup import setup, create_users, best, table
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from notification import payload
+
+
+def encode_v1(users, label, extra_context, on_site, sender):
+    return pickle.dumps([(user.pk, label, extra_context, on_site, sender)
+                         for user in users]).encode("base64")
+
+
+def main():
+    setup()
+    users = create_users(10000)
+    sender = users[0]
+    context = {"title": u"A new comment on your post", "url": "/posts/1/#c42"}
+    rows = []
+    for n in (1, 100, 10000):
+        recipients = users[:n]
+        ids = [user.pk for user in recipients]
+        v1 = encode_v1(recipients, "comment", context, True, sender)
+        v2 = payload.encode(ids, "comment", context, True, sender, compress=False)
+        v2z = payload.encode(ids, "comment", context, True, sender, compress=True)
+        for name, data, encode in (
+                ("pickle (v1)", v1, lambda: encode_v1(recipients, "comment", context, True, sender)),
+                ("v2", v2, lambda: payload.encode(ids, "comment", context, True, sender, compress=False)),
+                ("v2 zlib", v2z, lambda: payload.encode(ids, "comment", context, True, sender, compress=True))):
+            rows.append([n, name, len(data), best(encode), best(lambda: payload.decode(data))])
+    table(["recipients", "format", "bytes", "encode ms", "decode ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+'''
+Size and dump/load time of Notice.data (notification.serialization) against
+the pickled PickledObjectField storage used up to 0.2, and the queries needed
+to load the model instances of an inbox page.
+'''
+from benchsetup import setup, create_users, best, table
+
+from django.db import connection, reset_queries
+from django.conf import settings
+from picklefield.fields import dbsafe_decode, dbsafe_encode
+
+from notification import serialization
+
+
+def queries(func):
+    settings.DEBUG = True
+    reset_queries()
+    try:
+        func()
+        return len(connection.queries)
+    finally:
+        settings.DEBUG = False
+
+
+def main():
+    setup()
+    users = create_users(100)
+    contexts = [
+        ("plain", {"title": u"A new comment on your post", "url": "/posts/1/#c42", "count": 3}),
+        ("one instance", {"sender": users[0], "title": u"A new comment"}),
+        ("three instances", {"sender": users[0], "recipient": users[1],
+                             "mentions": [users[2]], "title": u"A new comment"}),
+    ]
+    rows = []
+    for name, context in contexts:
+        pickled = dbsafe_encode(context)
+        text = serialization.dumps(context)
+        rows.append([name, "pickle", len(pickled), best(lambda: dbsafe_encode(context), number=100),
+                     best(lambda: dbsafe_decode(pickled), number=100)])
+        rows.append([name, "json", len(text), best(lambda: serialization.dumps(context), number=100),
+                     best(lambda: serialization.loads(text), number=100)])
+    table(["context", "format", "bytes", "dump ms", "load ms"], rows)
+    print
+
+    # an inbox page: 50 notices, each about one of the users
+    pickled = [dbsafe_encode({"sender": user}) for user in users[:50]]
+    texts = [serialization.dumps({"sender": user}) for user in users[:50]]
+
+    def load_json():
+        values = [serialization.loads(text) for text in texts]
+        serialization.resolve(values)
+        return serialization.unwrap(values)
+
+    rows = [["pickle", best(lambda: [dbsafe_decode(data) for data in pickled]),
+             queries(lambda: [dbsafe_decode(data) for data in pickled])],
+            ["json + resolve", best(load_json), queries(load_json)]]
+    table(["50 notices", "load ms", "queries"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+'''
+Time to save the website notices of a send: one save per recipient
+(WebsiteBackend.deliver) against chunked bulk_create with the ids read back
+(WebsiteBackend.deliver_many).
+'''
+from benchsetup import setup, create_users, best, table
+
+from django.db import transaction
+
+from notification import models as notification
+from notification.backends.website import Notice
+
+
+def main():
+    setup()
+    users = create_users(1000)
+    sender = users[0]
+    notice_type = notification.NoticeType.objects.create(label="comment", display="Comment",
+                                                         description="a comment", default=2)
+    backend = notification.website
+    context = {"title": u"A new comment on your post", "url": "/posts/1/#c42"}
+
+    @transaction.commit_on_success
+    def per_row(recipients):
+        for recipient in recipients:
+            backend.deliver(recipient, sender, notice_type, context)
+
+    @transaction.commit_on_success
+    def bulk(recipients):
+        backend.deliver_many(recipients, sender, notice_type, context)
+
+    rows = []
+    for n in (10, 100, 1000):
+        recipients = users[:n]
+        rows.append([n, best(lambda: per_row(recipients), repeat=3),
+                     best(lambda: bulk(recipients), repeat=3)])
+        Notice.objects.all().delete()
+    table(["recipients", "save() ms", "bulk_create ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 from django.contrib import admin
 
 # This app
-from notification.models import NoticeType, NoticeSetting, Observation, NoticeQueueBatch
+from notification.models import (NoticeType, NoticeSetting, NoticeMute, Observation,
+                                 NoticeQueueBatch, DigestItem)
 #FIXME dinamically import classes of the type ModelAdmin and register them here
 from notification.backends.website import Notice
 
@@ -10,16 +11,27 @@ class NoticeTypeAdmin(admin.ModelAdmin):
     list_display = ["label", "display", "description", "default"]
 
 class NoticeSettingAdmin(admin.ModelAdmin):
-    list_display = ["id", "user", "notice_type", "medium", "send"]
+    list_display = ["id", "user", "notice_type", "medium", "send", "frequency"]
     
+class NoticeMuteAdmin(admin.ModelAdmin):
+    list_display = ["id", "user", "medium", "added"]
+
+class DigestItemAdmin(admin.ModelAdmin):
+    list_display = ["id", "user", "notice_type", "frequency", "added"]
+
 class NoticeAdmin(admin.ModelAdmin):
     list_display = ["id", "recipient", "sender", "notice_type", "data", "added", "unseen", "archived"]
 
+class NoticeQueueBatchAdmin(admin.ModelAdmin):
+    list_display = ["id", "locked_by", "locked_at"]
+
 class ObservationAdmin(admin.ModelAdmin):
     list_display = ["id", "content_type", "object_id", "observed_object", "user", "notice_type"]
 
 admin.site.register(NoticeType, NoticeTypeAdmin)
 admin.site.register(NoticeSetting, NoticeSettingAdmin)
+admin.site.register(NoticeMute, NoticeMuteAdmin)
+admin.site.register(DigestItem, DigestItemAdmin)
 admin.site.register(Notice, NoticeAdmin)
 admin.site.register(Observation, ObservationAdmin)
-admin.site.register(NoticeQueueBatch)
+admin.site.register(NoticeQueueBatch, NoticeQueueBatchAdmin)
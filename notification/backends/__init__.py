@@ -5,8 +5,38 @@ from django.core import exceptions
 
 from base import BaseBackend
 
-from django.template.loader import render_to_string
+from django.template.loader import select_template
 from django.template import Context
+from django.utils.translation import get_language
+
+'''
+NOTIFICATION_TEMPLATE_CACHE( = not DEBUG) keep the compiled notification
+templates for the life of the process instead of running the template loaders
+for every notice rendered.
+'''
+TEMPLATE_CACHE = getattr(settings, "NOTIFICATION_TEMPLATE_CACHE", not settings.DEBUG)
+
+_templates = {}
+
+def get_cached_template(template_names):
+    '''
+    select_template with a per process cache keyed by (template_names, language).
+    '''
+    key = (tuple(template_names), get_language())
+    template = _templates.get(key)
+    if template is None:
+        template = select_template(template_names)
+        if TEMPLATE_CACHE:
+            _templates[key] = template
+    return template
+
+def get_notification_template(template, label):
+    '''
+    Returns the compiled notification/<label>/<template> falling back to
+    notification/default/<template>.
+    '''
+    return get_cached_template(("notification/%s/%s" % (label, template),
+                                "notification/default/%s" % template))
 
 def format_notification(template, label, context):
     '''
@@ -14,10 +44,8 @@ def format_notification(template, label, context):
     '''
     # conditionally turn off autoescaping for .txt extensions in format
     autoescape = not template.endswith(".txt")
-    return render_to_string(("notification/%s/%s" % (label, template),
-                             "notification/default/%s" % template),
-                            context_instance=Context(context,
-                                autoescape=autoescape))
+    return get_notification_template(template, label).render(
+                            Context(context, autoescape=autoescape))
 
 # mostly for backend compatibility
 default_backends = (
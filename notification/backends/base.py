@@ -1,26 +1,76 @@
 
+from django.utils.translation import get_language, activate
+
+
 class BaseBackend(object):
     """
     The base backend.
+
+    send_now calls can_send_many and deliver_many with chunks of recipients.
+    Their default implementations fall back to can_send and deliver, backends
+    able to batch their I/O override them.
     """
+    # whether users may get this medium's notices in periodic digests
+    supports_digest = False
+    # whether deliveries may run on several threads at once, see
+    # notification.delivery
+    concurrent = False
+
     def __init__(self, medium_id, spam_sensitivity=None):
         self.medium_id = medium_id
         if spam_sensitivity is not None:
             self.spam_sensitivity = spam_sensitivity
 
-    def can_send(self, user, notice_type):
+    def can_send(self, user, notice_type, preferences=None):
         """
         Determines whether this backend is allowed to send a notification to
         the given user and notice_type.
+
+        preferences: optional send map as returned by
+        notification.models.get_notification_settings. When the user is found
+        in it no query is made.
         """
+        if preferences is not None:
+            send = preferences.get(str(self.medium_id), {}).get(user.pk)
+            if send is not None:
+                # may be a digest frequency
+                return bool(send)
         # XXX should be placed here to avoid circular import dependency
         from notification.models import should_send
         if should_send(user, notice_type, self.medium_id):
             return True
         return False
 
-    def deliver(self, recipient, notice_type, extra_context):
+    def can_send_many(self, users, notice_type, preferences=None):
+        """
+        Returns the users of the given list this backend is allowed to send
+        notice_type to, in the same order.
+        """
+        return [user for user in users
+                if self.can_send(user, notice_type, preferences)]
+
+    def deliver(self, recipient, sender, notice_type, extra_context):
         """
         Deliver a notification to the given recipient.
         """
-        raise NotImplemented()
+        raise NotImplementedError()
+
+    def deliver_many(self, recipients, sender, notice_type, shared_context,
+                     per_user_context):
+        """
+        Deliver a notification to every recipient.
+
+        shared_context: the context common to all recipients.
+        per_user_context: {recipient_id: context} the recipient specific part
+        of the context, LANGUAGE_CODE included.
+        """
+        current_language = get_language()
+        try:
+            for recipient in recipients:
+                user_context = per_user_context[recipient.pk]
+                activate(user_context.get("LANGUAGE_CODE", current_language))
+                context = dict(shared_context)
+                context.update(user_context)
+                self.deliver(recipient, sender, notice_type, context)
+        finally:
+            activate(current_language)
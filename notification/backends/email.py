@@ -1,11 +1,14 @@
+# Python Core
+import logging
+import smtplib
+
 # Django
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 
 from django.core.urlresolvers import reverse
 from django.template import Context
-from django.template.loader import render_to_string
-from django.utils.translation import ugettext
+from django.utils.translation import ugettext, get_language, activate
 
 # Django Apps
 from django.contrib.sites.models import Site
@@ -13,20 +16,111 @@ from django.contrib.sites.models import Site
 # This app
 from notification import backends
 
+'''
+NOTIFICATION_RENDER_ONCE( = False) render the message templates (short.txt,
+full.txt & full.html) once per language for a send instead of once per
+recipient. Recipient specific variables (recipient, unsubscribe_link,
+sender_url, notice_id...) are then only available to the email_body and
+email_subject templates, so only enable it once the message templates no
+longer use them (the default full.html links the sender with sender_url).
+'''
+RENDER_ONCE = getattr(settings, "NOTIFICATION_RENDER_ONCE", False)
+
+'''
+NOTIFICATION_EMAIL_BATCH_SIZE( = 100) number of emails built before they are
+pushed to the mail server.
+NOTIFICATION_EMAIL_RECONNECT_AFTER( = 500) number of emails sent over one
+connection before it is closed and a new one opened.
+'''
+BATCH_SIZE = getattr(settings, "NOTIFICATION_EMAIL_BATCH_SIZE", 100)
+RECONNECT_AFTER = getattr(settings, "NOTIFICATION_EMAIL_RECONNECT_AFTER", 500)
+
+logger = logging.getLogger("notification")
+
+
+class BulkMailer(object):
+    """
+    Sends messages over a single reused email connection, reconnecting every
+    ``reconnect_after`` messages. A message that fails is recorded in
+    ``failures`` as a (message, exception) tuple and does not stop the others.
+    When the mail server can't be connected to, the rest of the messages
+    given to send_messages are recorded as failed; the next call connects
+    again.
+    """
+    def __init__(self, reconnect_after=RECONNECT_AFTER):
+        self.reconnect_after = reconnect_after
+        self.connection = None
+        self.sent_on_connection = 0
+        self.sent = 0
+        self.failures = []
+
+    def open(self):
+        self.close()
+        self.connection = get_connection()
+        self.connection.open()
+        self.sent_on_connection = 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def send_messages(self, messages):
+        messages = list(messages)
+        for i, msg in enumerate(messages):
+            if self.connection is None or self.sent_on_connection >= self.reconnect_after:
+                try:
+                    self.open()
+                except Exception, e:
+                    logger.exception("connecting to the mail server failed, %s notification "
+                                     "emails not sent" % (len(messages) - i))
+                    self.close()
+                    self.failures.extend((failed, e) for failed in messages[i:])
+                    return
+            try:
+                self.connection.send_messages([msg])
+                self.sent += 1
+            except smtplib.SMTPRecipientsRefused, e:
+                # the connection is still usable
+                self.failures.append((msg, e))
+                logger.warning("notification email to %s refused" % ", ".join(msg.to))
+            except Exception, e:
+                self.failures.append((msg, e))
+                logger.exception("sending notification email to %s failed" % ", ".join(msg.to))
+                self.close()
+            self.sent_on_connection += 1
+
+
+def unsubscribe_headers(context):
+    """
+    RFC 8058 headers letting mail providers unsubscribe with a single POST.
+    """
+    if not context.get("one_click_unsubscribe_link"):
+        return {}
+    return {"List-Unsubscribe": "<%s>" % context["one_click_unsubscribe_link"],
+            "List-Unsubscribe-Post": "List-Unsubscribe=One-Click"}
+
 
 class EmailBackend(backends.BaseBackend):
     spam_sensitivity = 2
+    supports_digest = True
+    # every deliver_many call opens its own connection
+    concurrent = True
 
-    def can_send(self, user, notice_type):
-        can_send = super(EmailBackend, self).can_send(user, notice_type)
+    def can_send(self, user, notice_type, preferences=None):
+        can_send = super(EmailBackend, self).can_send(user, notice_type,
+                                                      preferences)
         if can_send and user.email:
             return True
         return False
 
-    def deliver(self, recipient, sender, notice_type, extra_context):
-
-        context = Context(extra_context)
-        
+    def render_messages(self, notice_type, context):
+        """
+        Renders the (short, message_txt, message) fragments of a notice.
+        """
         short = backends.format_notification("short.txt",
                                              notice_type.label,
                                              context).rstrip('\n').rstrip('\r')
@@ -38,21 +132,107 @@ class EmailBackend(backends.BaseBackend):
         message = backends.format_notification("full.html",
                                                notice_type.label,
                                                context)
+        return short, message_txt, message
+
+    def build_message(self, recipient, extra_context, messages):
+        """
+        Renders the recipient specific email around the message fragments.
+        """
+        short, message_txt, message = messages
+        context = Context(extra_context)
 
-        body = render_to_string(("notification/email_body.html",
-                                 "notification/default/email_body.html"),
-                                {"message": message}, context)
+        context.update({"message": message})
+        body = backends.get_cached_template(("notification/email_body.html",
+                                             "notification/default/email_body.html"))\
+                       .render(context)
+        context.pop()
 
         context.autoescape = False
-        subject = render_to_string(("notification/email_subject.txt",
-                                    "notification/default/email_subject.txt"),
-                                  {"message": short}, context).rstrip('\n').rstrip('\r')
-        body_txt = render_to_string(("notification/default/email_body.txt",
-                                     "notification/email_body.html"),
-                                    {"message": message_txt}, context)
+        context.update({"message": short})
+        subject = backends.get_cached_template(("notification/email_subject.txt",
+                                                "notification/default/email_subject.txt"))\
+                          .render(context).rstrip('\n').rstrip('\r')
+        context.pop()
+
+        context.update({"message": message_txt})
+        body_txt = backends.get_cached_template(("notification/default/email_body.txt",
+                                                 "notification/email_body.html"))\
+                           .render(context)
+        context.pop()
 
         msg = EmailMultiAlternatives(subject, body_txt,
-                settings.DEFAULT_FROM_EMAIL, [recipient.email])
+                settings.DEFAULT_FROM_EMAIL, [recipient.email],
+                headers=unsubscribe_headers(extra_context))
 
         msg.attach_alternative(body, "text/html")
-        msg.send()
+        return msg
+
+    def deliver(self, recipient, sender, notice_type, extra_context):
+        messages = self.render_messages(notice_type, extra_context)
+        self.build_message(recipient, extra_context, messages).send()
+
+    def deliver_many(self, recipients, sender, notice_type, shared_context,
+                     per_user_context):
+        """
+        Emails every recipient. With NOTIFICATION_RENDER_ONCE the message
+        fragments are rendered from shared_context once per language.
+
+        Messages are sent in batches of NOTIFICATION_EMAIL_BATCH_SIZE over a
+        reused connection (see BulkMailer). Returns the list of
+        (message, exception) failures.
+
+        The fragments of recipients who chose a digest for notice_type are
+        stored as DigestItems for the send_digests command instead, before
+        any email is sent so a mail server failure can't lose them.
+        """
+        from notification.models import (DigestItem, DIGEST_FREQUENCIES,
+                                         get_notification_settings)
+        frequencies = get_notification_settings(recipients, notice_type,
+                                                [self.medium_id])[str(self.medium_id)]
+        current_language = get_language()
+        rendered = {}
+
+        def render(recipient):
+            user_context = per_user_context[recipient.pk]
+            language = user_context.get("LANGUAGE_CODE", current_language)
+            activate(language)
+            context = dict(shared_context)
+            context.update(user_context)
+            if not RENDER_ONCE:
+                return context, self.render_messages(notice_type, context)
+            if language not in rendered:
+                rendered[language] = self.render_messages(notice_type, shared_context)
+            return context, rendered[language]
+
+        digests = []
+        immediate = []
+        for recipient in recipients:
+            if frequencies.get(recipient.pk) in DIGEST_FREQUENCIES:
+                digests.append(recipient)
+            else:
+                immediate.append(recipient)
+
+        mailer = BulkMailer()
+        try:
+            items = []
+            for recipient in digests:
+                context, (short, message_txt, message) = render(recipient)
+                items.append(DigestItem(user=recipient, notice_type=notice_type,
+                                        frequency=frequencies[recipient.pk],
+                                        short=short, message_txt=message_txt,
+                                        message=message))
+            if items:
+                DigestItem.objects.bulk_create(items)
+
+            outbox = []
+            for recipient in immediate:
+                context, messages = render(recipient)
+                outbox.append(self.build_message(recipient, context, messages))
+                if len(outbox) >= BATCH_SIZE:
+                    mailer.send_messages(outbox)
+                    outbox = []
+            mailer.send_messages(outbox)
+        finally:
+            mailer.close()
+            activate(current_language)
+        return mailer.failures
@@ -3,21 +3,24 @@ from datetime import datetime, timedelta
 
 # Django
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.core.urlresolvers import reverse
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import get_language
 
 # Django Apps
 from django.contrib.sites.models import Site
 from django.utils.timezone import * 
-
-# PickleField
-from picklefield.fields import PickledObjectField
+from django.utils import timezone
 
 # This app
-from notification import backends
+from notification import backends, caching, serialization
+from notification.fields import NoticeDataField
 from notification.models import NoticeType
 from django.conf import settings
 
@@ -41,14 +44,26 @@ class NoticeManager(models.Manager):
         Marks all notifications emitted by the sender to the receiver as read.
         This function is tipically called when the receiver views the sender,
         so the notification about the sender isn't "fresh" anymore.
+        Returns the number of notices marked.
         '''
         if receiver.is_anonymous():
-            return
+            return 0
         ctype = ContentType.objects.get_for_model(sender)
-        for n in self.filter(content_type=ctype, object_id=sender.id,
-                             recipient=receiver):
-            n.unseen = False
-            n.save()
+        count = self.filter(content_type=ctype, object_id=sender.id,
+                            recipient=receiver, unseen=True).update(unseen=False)
+        if count:
+            reset_unseen_count(receiver.pk)
+        return count
+
+    def mark_all_seen(self, user):
+        '''
+        Marks all unseen (not archived) notices of the user as seen with a
+        single UPDATE. Returns the number of notices marked.
+        '''
+        count = self.notices_for(user, unseen=True).update(unseen=False)
+        if count:
+            reset_unseen_count(user.pk)
+        return count
 
     def unseen_count_for(self, recipient, **kwargs):
         """
@@ -56,6 +71,62 @@ class NoticeManager(models.Manager):
         """
         return self.notices_for(recipient, unseen=True, **kwargs).count()
 
+    def cached_unseen_count_for(self, recipient):
+        """
+        unseen_count_for backed by a per user counter in the notification
+        cache. The counter is incremented on delivery and dropped whenever
+        notices change state, so it is recounted on the next read.
+        """
+        key = unseen_count_key(recipient.pk)
+        count = caching.cache.get(key)
+        if count is None:
+            count = self.unseen_count_for(recipient)
+            caching.cache.add(key, count, UNSEEN_COUNT_TIMEOUT)
+        return count
+
+
+def unseen_count_key(user_id):
+    return "notification.unseen_count.%s" % user_id
+
+
+def incr_unseen_count(user_id, delta=1):
+    """
+    Adjusts the cached unseen counter of a user if it is cached.
+    """
+    count = caching.incr(unseen_count_key(user_id), delta)
+    if count is not None and count < 0:
+        reset_unseen_count(user_id)
+
+
+def reset_unseen_count(*user_ids):
+    """
+    Drops the cached unseen counters of the given users.
+    """
+    caching.cache.delete_many([unseen_count_key(user_id) for user_id in user_ids])
+
+
+'''
+NOTIFICATION_BULK_CHUNK_SIZE( = 500) number of notices inserted per query.
+'''
+BULK_CHUNK_SIZE = getattr(settings, "NOTIFICATION_BULK_CHUNK_SIZE", 500)
+
+'''
+NOTIFICATION_UNSEEN_COUNT_TIMEOUT( = 86400) seconds a user's cached unseen
+notice counter is kept.
+'''
+UNSEEN_COUNT_TIMEOUT = getattr(settings, "NOTIFICATION_UNSEEN_COUNT_TIMEOUT", 86400)
+
+'''
+NOTIFICATION_RENDER_CACHE( = False) cache the rendered notices (per notice,
+template and language) so inbox pages are mostly cache reads.
+NOTIFICATION_RENDER_CACHE_TIMEOUT( = 604800) seconds a rendered notice is kept.
+NOTIFICATION_RENDER_CACHE_VERSION( = 1) change it when the notification
+templates change to discard every cached rendering. Saving or deleting a
+NoticeType does the same.
+'''
+RENDER_CACHE = getattr(settings, "NOTIFICATION_RENDER_CACHE", False)
+RENDER_CACHE_TIMEOUT = getattr(settings, "NOTIFICATION_RENDER_CACHE_TIMEOUT", 604800)
+RENDER_CACHE_VERSION = getattr(settings, "NOTIFICATION_RENDER_CACHE_VERSION", 1)
 
 # prevent error on initial syncdb for apps that incorporate django-notification-automated
 try:
@@ -77,8 +148,11 @@ class Notice(models.Model):
     added = models.DateTimeField(_("added"), auto_now_add=True)
     unseen = models.BooleanField(_("unseen"), default=True)
     archived = models.BooleanField(_("archived"), default=False)
+    # number of notices it stands for, see notification.throttle
+    occurrences = models.PositiveIntegerField(_("occurrences"), default=1)
 
-    data = PickledObjectField()
+    # extra_context of the send, model instances are stored as references
+    data = NoticeDataField()
 
     # Polymorphic relation to allow any object to be the sender
     content_type = models.ForeignKey(ContentType)
@@ -93,7 +167,10 @@ class Notice(models.Model):
     def archive(self):
         self.archived = True
         self.save()
-        
+        # archived notices are not counted as unseen
+        if self.unseen:
+            reset_unseen_count(self.recipient_id)
+
     def get_context(self):
         """
         website specific context for use in all templates when website is present
@@ -101,6 +178,7 @@ class Notice(models.Model):
         return  {  "added": self.added,
                    "unseen": self.unseen,
                    "archived": self.archived,
+                   "occurrences": self.occurrences,
                    "content_type": self.content_type,#remove this
                    "sender_type": self.content_type.name, 
                    "object_id": self.object_id,
@@ -127,21 +205,39 @@ class Notice(models.Model):
     def render(self, template='website.html'):
         """
         Render the notification with the given template.
+        Uses the output of render_many when the notice went through it, then
+        the render cache when NOTIFICATION_RENDER_CACHE is enabled.
         """
+        rendered = getattr(self, "_rendered", {})
+        if template in rendered:
+            return rendered[template]
+        if not RENDER_CACHE:
+            return self.render_uncached(template)
+
+        key = render_cache_key(render_cache_prefix(), self, template)
+        html = caching.cache.get(key)
+        if html is None:
+            html = self.render_uncached(template)
+            caching.cache.set(key, html, RENDER_CACHE_TIMEOUT)
+        return html
 
-        if not self.data: self.data = {}
+    def render_uncached(self, template='website.html'):
+        """
+        Renders the notification with the given template from scratch.
+        """
+        serialization.resolve([self.data])
+        # work on a copy, self.data must not get rendered html saved into it
+        context = dict(self.data or {})
         
         #provide context to replicate context provided by notification.send() for all templates
-        self.data.update({  "recipient": self.recipient, 
+        context.update({    "recipient": self.recipient, 
                             "sender": self.sender,  
                             "notice": self.notice_type,
                             "root_url": root_url,
                             "sender_url": self.get_sender_url(),
                         })
         #provide website specific context
-        self.data.update(self.get_context())
-        
-        context = self.data
+        context.update(self.get_context())
         
         short = backends.format_notification("short.txt",
                                              self.notice_type.label,
@@ -156,7 +252,7 @@ class Notice(models.Model):
                                                context)
         
         #provide website template specific context
-        self.data.update({  'message_short':short, 
+        context.update({    'message_short':short, 
                             'message_full':full,
                             'message_full_html':full_html,
                         })
@@ -176,8 +272,11 @@ class Notice(models.Model):
         if unseen:
             self.unseen = False
             self.save()
+            reset_unseen_count(self.recipient_id)
         return unseen
 
+    # composite indexes for notices_for, unseen_count_for & mark_read are
+    # created by migration 0007 (Meta has no way to declare them)
     class Meta:
         app_label = 'notification'  # needed for syncdb
         ordering = ["-added"]
@@ -185,6 +284,136 @@ class Notice(models.Model):
         verbose_name_plural = _("notices")
 
 
+def prefetch_related_objects(notices):
+    """
+    Loads the senders, the instances referenced in Notice.data, recipients,
+    notice types and content types of the given notices in bulk (one query
+    per content type plus one for the recipients) and caches them on each
+    notice.
+    """
+    from notification.models import get_notice_types
+    notice_types = dict((nt.id, nt) for nt in get_notice_types().values())
+    sender_cache = Notice.sender.cache_attr
+    recipient_cache = Notice._meta.get_field("recipient").get_cache_name()
+    notice_type_cache = Notice._meta.get_field("notice_type").get_cache_name()
+    content_type_cache = Notice._meta.get_field("content_type").get_cache_name()
+
+    object_ids = {}
+    recipient_ids = set()
+    refs = []
+    for notice in notices:
+        object_ids.setdefault(notice.content_type_id, set()).add(notice.object_id)
+        if not hasattr(notice, recipient_cache):
+            recipient_ids.add(notice.recipient_id)
+        for ref in serialization.references(notice.data):
+            content_type_id, pk = serialization.reference_key(ref)
+            object_ids.setdefault(content_type_id, set()).add(pk)
+            refs.append(ref)
+
+    senders = {}
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            senders[content_type_id] = model._default_manager.in_bulk(list(ids))
+    recipients = User.objects.in_bulk(list(recipient_ids)) if recipient_ids else {}
+
+    for ref in refs:
+        content_type_id, pk = serialization.reference_key(ref)
+        serialization.set_reference(ref, senders.get(content_type_id, {}).get(pk))
+
+    for notice in notices:
+        setattr(notice, content_type_cache,
+                ContentType.objects.get_for_id(notice.content_type_id))
+        setattr(notice, sender_cache,
+                senders.get(notice.content_type_id, {}).get(notice.object_id))
+        if notice.recipient_id in recipients:
+            setattr(notice, recipient_cache, recipients[notice.recipient_id])
+        if notice.notice_type_id in notice_types:
+            setattr(notice, notice_type_cache, notice_types[notice.notice_type_id])
+
+
+def render_many(notices, template='website.html'):
+    """
+    Renders a list of notices with the given template, prefetching what they
+    need in bulk (see prefetch_related_objects). Returns the rendered strings
+    in the order of notices; notice.render(template) returns the same string
+    afterwards without rendering again.
+
+    With NOTIFICATION_RENDER_CACHE the cached renderings are read with a
+    single get_many and only the missing notices are rendered.
+    """
+    notices = list(notices)
+    keys = {}
+    cached = {}
+    if RENDER_CACHE:
+        prefix = render_cache_prefix()
+        keys = dict((notice.id, render_cache_key(prefix, notice, template))
+                    for notice in notices)
+        cached = caching.cache.get_many(keys.values())
+
+    missing = [notice for notice in notices if keys.get(notice.id) not in cached]
+    prefetch_related_objects(missing)
+    new = {}
+    for notice in missing:
+        html = notice.render_uncached(template)
+        if RENDER_CACHE:
+            new[keys[notice.id]] = html
+            cached[keys[notice.id]] = html
+        notice._rendered = dict(getattr(notice, "_rendered", {}), **{template: html})
+    if new:
+        caching.cache.set_many(new, RENDER_CACHE_TIMEOUT)
+
+    rendered = []
+    for notice in notices:
+        if keys:
+            html = cached[keys[notice.id]]
+            notice._rendered = dict(getattr(notice, "_rendered", {}), **{template: html})
+        rendered.append(notice._rendered[template])
+    return rendered
+
+
+RENDER_GENERATION_KEY = "notification.render.generation"
+
+
+def render_cache_prefix():
+    return "notification.render.%s.%s" % (RENDER_CACHE_VERSION,
+                                          caching.get_generation(RENDER_GENERATION_KEY))
+
+
+def render_cache_key(prefix, notice, template):
+    """
+    Cached renderings depend on the notice, the template, the language and
+    the unseen/archived flags and occurrences templates may show.
+    """
+    return "%s.%s.%s.%s.%d%d.%d" % (prefix, notice.id, template, get_language(),
+                                    notice.unseen, notice.archived, notice.occurrences)
+
+
+@receiver(post_save, sender=NoticeType)
+@receiver(post_delete, sender=NoticeType)
+def invalidate_render_cache(sender, **kwargs):
+    if RENDER_CACHE:
+        caching.bump_generation(RENDER_GENERATION_KEY)
+
+
+def collapse_repeats(recipients, notice_type, sender, window):
+    """
+    Counts one more occurrence on the unarchived notices of notice_type about
+    sender added to recipients in the last window seconds, marking them
+    unseen again.
+    """
+    content_type = ContentType.objects.get_for_model(sender)
+    since = timezone.now() - timedelta(seconds=window)
+    Notice.objects.filter(recipient__in=recipients,
+                          notice_type=notice_type,
+                          content_type=content_type,
+                          object_id=sender.pk,
+                          archived=False,
+                          added__gte=since)\
+                  .update(occurrences=F("occurrences") + 1, unseen=True)
+    reset_unseen_count(*[recipient.pk for recipient in recipients])
+
+
 class WebsiteBackend(backends.BaseBackend):
     """
     Stores the notification on the website, they will be shown when the user
@@ -200,3 +429,48 @@ class WebsiteBackend(backends.BaseBackend):
                               sender=sender,
                               data=extra_context,
                               notice_type=notice_type)
+        incr_unseen_count(recipient.pk)
+
+    def deliver_many(self, recipients, sender, notice_type, shared_context,
+                     per_user_context=None):
+        """
+        Saves the notifications of all recipients with chunked bulk_create.
+        Returns a dictionary {recipient_id: notice} of the created notices,
+        with their ids set.
+
+        bulk_create does not return the new ids, they are read back matching
+        the recipient, notice type, sender, data and creation time. Two sends
+        of the same notice (same type, sender and extra_context) to the same
+        user at the same moment can't be told apart: both may get the id of
+        the same one of the two identical notices.
+        """
+        content_type = ContentType.objects.get_for_model(sender)
+        notices = {}
+        recipients = list(recipients)
+        for i in xrange(0, len(recipients), BULK_CHUNK_SIZE):
+            chunk = [Notice(recipient=recipient,
+                            notice_type=notice_type,
+                            content_type=content_type,
+                            object_id=sender.pk,
+                            data=shared_context)
+                     for recipient in recipients[i:i + BULK_CHUNK_SIZE]]
+            # whole seconds: some databases drop the microseconds of added
+            started = timezone.now().replace(microsecond=0)
+            Notice.objects.bulk_create(chunk)
+            missing = [n for n in chunk if n.pk is None]
+            if missing:
+                # the database did not return the new ids, read them back
+                ids = Notice.objects.filter(notice_type=notice_type,
+                                            content_type=content_type,
+                                            object_id=sender.pk,
+                                            data=shared_context,
+                                            added__gte=started,
+                                            recipient__in=[n.recipient_id for n in missing])\
+                                    .values_list("recipient", "id")
+                ids = dict(sorted(ids, key=lambda row: row[1]))
+                for n in missing:
+                    n.id = ids.get(n.recipient_id)
+            for n in chunk:
+                notices[n.recipient_id] = n
+                incr_unseen_count(n.recipient_id)
+        return notices
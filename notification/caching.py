@@ -0,0 +1,96 @@
+'''
+Cache used by the app for the unseen notice counters and other shared state.
+
+NOTIFICATION_CACHE( = "default") alias of the cache (see CACHES) to use.
+'''
+# Python Core
+import threading
+import time
+from collections import OrderedDict
+
+# Django
+from django.conf import settings
+from django.core.cache import get_cache
+
+CACHE_ALIAS = getattr(settings, "NOTIFICATION_CACHE", "default")
+
+cache = get_cache(CACHE_ALIAS)
+
+# generations outlive anything keyed by them
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def incr(key, delta=1):
+    '''
+    Atomically adds delta to a cached integer. Does nothing if the key is not
+    cached (it will be computed again on the next read). Returns the new value
+    or None.
+    '''
+    try:
+        if delta >= 0:
+            return cache.incr(key, delta)
+        return cache.decr(key, -delta)
+    except ValueError:
+        return None
+
+
+def get_generation(key):
+    '''
+    Returns the generation stored at key, used to version other cache keys.
+    Generations are timestamps so one evicted from the cache never comes back
+    with an older value.
+    '''
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), GENERATION_TIMEOUT)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(key):
+    '''
+    Starts a new generation, invalidating everything keyed by the previous one.
+    '''
+    cache.set(key, int(time.time() * 1000), GENERATION_TIMEOUT)
+
+
+class LocalCache(object):
+    '''
+    Thread safe LRU mapping whose entries expire after ttl seconds (or the
+    ttl given to set).
+    '''
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] < time.time():
+                return None
+            self._data[key] = item
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        if self.size <= 0:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
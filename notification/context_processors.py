@@ -4,10 +4,18 @@ def notification(request):
     user = request.user
 
     if user.is_authenticated():
-        count = Notice.objects.unseen_count_for(user)
-        unseen = 'none'
-        if count > 0:
-            unseen = 'unseen'
-        return {"notice_unseen_count": count,'notice_unseen':unseen}
+        # templates call these lazily, so pages that never show the count
+        # don't pay for it, and pages that do cost one cache get.
+        counts = {}
+        def notice_unseen_count():
+            if "count" not in counts:
+                counts["count"] = Notice.objects.cached_unseen_count_for(user)
+            return counts["count"]
+        def notice_unseen():
+            if notice_unseen_count() > 0:
+                return 'unseen'
+            return 'none'
+        return {"notice_unseen_count": notice_unseen_count,
+                'notice_unseen': notice_unseen}
     else:
         return {}
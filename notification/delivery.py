@@ -0,0 +1,139 @@
+'''
+Concurrent delivery of a send to the backends, used by send_now (and so by
+emit_notices) when NOTIFICATION_CONCURRENT_DELIVERY is enabled so one slow
+SMTP server or webhook does not hold back the other backends, nor the other
+recipients of the same backend.
+
+Deliveries run on a pool of daemon threads shared by all backends. The
+recipients of each backend are split in chunks delivered by at most
+"concurrency" threads at a time, through the backend's deliver_many
+(BaseBackend's falls back to deliver). Backends whose deliveries are thread
+safe declare ``concurrent = True`` (the email backend does); the others
+default to a concurrency of 1, so they only run alongside the other backends.
+
+NOTIFICATION_CONCURRENT_DELIVERY( = False) deliver through the thread pool.
+NOTIFICATION_DELIVERY_WORKERS( = 8) number of threads shared by all backends.
+NOTIFICATION_DELIVERY_LIMITS( = {}) per backend label {"concurrency": n,
+"timeout": seconds, "chunk_size": n} overriding the defaults below.
+NOTIFICATION_DELIVERY_CONCURRENCY( = 4) threads a concurrent backend may use
+at once.
+NOTIFICATION_DELIVERY_TIMEOUT( = 60) seconds send_now waits for a backend.
+Chunks not started by then are dropped (and logged), a chunk already being
+delivered can't be interrupted and finishes in the background.
+NOTIFICATION_DELIVERY_CHUNK_SIZE( = 100) recipients per chunk.
+'''
+# Python Core
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+# Django
+from django.conf import settings
+from django.utils.translation import deactivate
+
+# This app
+from notification.executor import DeliveryExecutor
+
+CONCURRENT_DELIVERY = getattr(settings, "NOTIFICATION_CONCURRENT_DELIVERY", False)
+WORKERS = getattr(settings, "NOTIFICATION_DELIVERY_WORKERS", 8)
+LIMITS = getattr(settings, "NOTIFICATION_DELIVERY_LIMITS", {})
+CONCURRENCY = getattr(settings, "NOTIFICATION_DELIVERY_CONCURRENCY", 4)
+TIMEOUT = getattr(settings, "NOTIFICATION_DELIVERY_TIMEOUT", 60)
+CHUNK_SIZE = getattr(settings, "NOTIFICATION_DELIVERY_CHUNK_SIZE", 100)
+
+logger = logging.getLogger("notification")
+
+# unbounded queue: runners never wait for room, they are bounded by the limits
+pool = DeliveryExecutor(workers=WORKERS, queue_size=0)
+atexit.register(pool.shutdown)
+
+
+def get_limits(label, backend):
+    '''
+    Returns the (concurrency, timeout, chunk_size) of backend label.
+    '''
+    limits = LIMITS.get(label, {})
+    concurrency = CONCURRENCY if getattr(backend, "concurrent", False) else 1
+    return (limits.get("concurrency", concurrency),
+            limits.get("timeout", TIMEOUT),
+            limits.get("chunk_size", CHUNK_SIZE))
+
+
+class BackendRun(object):
+    '''
+    The chunks of one backend left to deliver, shared by its runners.
+    '''
+    def __init__(self, label, backend, recipients, chunk_size, timeout):
+        self.label = label
+        self.backend = backend
+        self.deadline = time.time() + timeout
+        self.chunks = deque(recipients[i:i + chunk_size]
+                            for i in xrange(0, len(recipients), chunk_size))
+        self.stats = {"delivered": 0, "failed": 0, "timed_out": 0}
+        self._lock = threading.Lock()
+
+    def next_chunk(self):
+        with self._lock:
+            if not self.chunks:
+                return None
+            if time.time() > self.deadline:
+                dropped = sum(len(chunk) for chunk in self.chunks)
+                self.stats["timed_out"] += dropped
+                self.chunks.clear()
+                logger.warning("%s delivery timed out, %s notices dropped"
+                               % (self.label, dropped))
+                return None
+            return self.chunks.popleft()
+
+    def count(self, key, n):
+        with self._lock:
+            self.stats[key] += n
+
+
+def _run(run, sender, notice_type, shared_context, per_user_context):
+    try:
+        while True:
+            chunk = run.next_chunk()
+            if chunk is None:
+                return
+            try:
+                run.backend.deliver_many(chunk, sender, notice_type,
+                                         shared_context, per_user_context)
+                run.count("delivered", len(chunk))
+            except Exception:
+                logger.exception("%s delivery of %s notices failed"
+                                 % (run.label, notice_type.label))
+                run.count("failed", len(chunk))
+    finally:
+        deactivate()
+
+
+def deliver(deliveries, sender, notice_type, shared_context, per_user_context):
+    '''
+    Delivers a notice through several backends concurrently and waits for
+    them, at most until the largest backend timeout.
+
+    deliveries: list of (label, backend, recipients).
+
+    Returns {label: {"delivered", "failed", "timed_out"}} recipient counts,
+    chunks still running after the timeout are not counted.
+    '''
+    runs = []
+    handles = []
+    for label, backend, recipients in deliveries:
+        if not recipients:
+            continue
+        concurrency, timeout, chunk_size = get_limits(label, backend)
+        run = BackendRun(label, backend, list(recipients), chunk_size, timeout)
+        runs.append(run)
+        for i in xrange(min(concurrency, len(run.chunks))):
+            handles.append(pool.submit(_run, run, sender, notice_type,
+                                       shared_context, per_user_context))
+    if runs:
+        deadline = max(run.deadline for run in runs)
+        for handle in handles:
+            if not handle.wait(max(deadline - time.time(), 0)):
+                break
+    return dict((run.label, dict(run.stats)) for run in runs)
@@ -0,0 +1,160 @@
+'''
+Emails the DigestItems stored by the email backend for users who chose a
+digest frequency for a notice type, see the send_digests command.
+
+NOTIFICATION_DIGEST_CHUNK_SIZE( = 200) number of users whose digests are
+built per query.
+'''
+# Django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMultiAlternatives
+from django.core.signing import Signer
+from django.core.urlresolvers import reverse
+from django.db.models import Max
+from django.template import Context
+from django.utils.translation import get_language, activate
+
+# This app
+from notification import backends
+from notification.backends.email import BulkMailer, unsubscribe_headers, BATCH_SIZE
+from notification.models import (DigestItem, get_notification_language,
+                                 LanguageStoreNotAvailable, get_unsubscribe_links,
+                                 get_notice_types)
+
+CHUNK_SIZE = getattr(settings, "NOTIFICATION_DIGEST_CHUNK_SIZE", 200)
+
+
+def render_template(names, context, autoescape=True):
+    return backends.get_cached_template(names).render(Context(context, autoescape=autoescape))
+
+
+def build_digest(user, items, frequency, signer):
+    '''
+    Renders the digest email of user: every item through
+    notification/<label>/digest_item.(html|txt), then the whole through the
+    digest_subject.txt, digest_body.txt and digest_body.html templates.
+    '''
+    from notification.models import root_url, current_site
+    notice_types = dict((nt.id, nt) for nt in get_notice_types().values())
+    unsubscribe_link, one_click_link = get_unsubscribe_links(user, signer=signer)
+    entries = []
+    for item in items:
+        notice_type = notice_types.get(item.notice_type_id) or item.notice_type
+        context = {
+            "notice": notice_type,
+            "added": item.added,
+            "short": item.short,
+            "message": item.message,
+            "message_txt": item.message_txt,
+        }
+        entries.append({
+            "notice": notice_type,
+            "added": item.added,
+            "short": item.short,
+            "html": backends.format_notification("digest_item.html", notice_type.label, context),
+            "txt": backends.format_notification("digest_item.txt", notice_type.label, context),
+        })
+
+    context = {
+        "recipient": user,
+        "entries": entries,
+        "count": len(entries),
+        "frequency": frequency,
+        "notices_url": root_url + reverse("notification_notices"),
+        "notice_settings_url": root_url + reverse("notification_notice_settings"),
+        "root_url": root_url,
+        "current_site": current_site,
+        "unsubscribe_link": unsubscribe_link,
+        "one_click_unsubscribe_link": one_click_link,
+    }
+    subject = render_template(("notification/digest_subject.txt",
+                               "notification/default/digest_subject.txt"),
+                              context, autoescape=False)
+    body_txt = render_template(("notification/digest_body.txt",
+                                "notification/default/digest_body.txt"),
+                               context, autoescape=False)
+    body = render_template(("notification/digest_body.html",
+                            "notification/default/digest_body.html"), context)
+    msg = EmailMultiAlternatives(" ".join(subject.split()), body_txt,
+                                 settings.DEFAULT_FROM_EMAIL, [user.email],
+                                 headers=unsubscribe_headers(context))
+    msg.attach_alternative(body, "text/html")
+    return msg
+
+
+def _send(mailer, outbox, stats):
+    '''
+    Sends the (message, items) pairs of outbox. Returns the items sent.
+    '''
+    failures = len(mailer.failures)
+    mailer.send_messages([message for message, items in outbox])
+    failed = set(id(message) for message, e in mailer.failures[failures:])
+    sent = []
+    for message, items in outbox:
+        if id(message) in failed:
+            stats["failed"] += 1
+        else:
+            stats["users"] += 1
+            stats["items"] += len(items)
+            sent.extend(items)
+    return sent
+
+
+def send_digests(frequency, chunk_size=CHUNK_SIZE):
+    '''
+    Emails one digest per user holding all their pending DigestItems of
+    frequency, users being processed chunk_size at a time. Items stored while
+    it runs are left for the next run, as are the items of users whose email
+    failed. Returns a {"users", "items", "failed"} dictionary.
+    '''
+    stats = {"users": 0, "items": 0, "failed": 0}
+    pending = DigestItem.objects.filter(frequency=frequency)
+    last_id = pending.aggregate(last=Max("id"))["last"]
+    if last_id is None:
+        return stats
+    pending = pending.filter(id__lte=last_id)
+
+    current_language = get_language()
+    signer = Signer()
+    mailer = BulkMailer()
+    last_user = 0
+    try:
+        while True:
+            user_ids = list(pending.filter(user__gt=last_user)
+                                   .order_by("user")
+                                   .values_list("user", flat=True)
+                                   .distinct()[:chunk_size])
+            if not user_ids:
+                break
+            last_user = user_ids[-1]
+
+            items = {}
+            for item in pending.filter(user__in=user_ids).order_by("user", "added", "id"):
+                items.setdefault(item.user_id, []).append(item)
+            users = User.objects.in_bulk(user_ids)
+
+            done = []
+            outbox = []
+            for user_id, user_items in items.items():
+                user = users.get(user_id)
+                if user is None or not user.email:
+                    # can't be emailed, drop the items
+                    done.extend(user_items)
+                    continue
+                try:
+                    activate(get_notification_language(user))
+                except LanguageStoreNotAvailable:
+                    activate(current_language)
+                outbox.append((build_digest(user, user_items, frequency, signer), user_items))
+                if len(outbox) >= BATCH_SIZE:
+                    done.extend(_send(mailer, outbox, stats))
+                    outbox = []
+            done.extend(_send(mailer, outbox, stats))
+
+            if done:
+                DigestItem.objects.filter(id__in=[item.id for item in done]).delete()
+    finally:
+        mailer.close()
+        activate(current_language)
+    return stats
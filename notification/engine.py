@@ -0,0 +1,159 @@
+# Python Core
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from multiprocessing import Pool
+
+# Django
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+# This app
+from notification import payload
+from notification.models import (NoticeQueueBatch, send_now, chunked,
+                                 SETTINGS_CHUNK_SIZE)
+
+'''
+NOTIFICATION_LOCK_EXPIRE( = 3600) seconds after which a batch claimed by a
+worker that never finished it (crashed, killed...) can be claimed again.
+'''
+LOCK_EXPIRE = getattr(settings, "NOTIFICATION_LOCK_EXPIRE", 3600)
+
+logger = logging.getLogger("notification")
+
+
+def get_lock_token():
+    '''
+    Identifies the process claiming batches.
+    '''
+    return "%s:%s:%s" % (socket.gethostname()[:40], os.getpid(), int(time.time()))
+
+
+def _claimable():
+    expired = timezone.now() - timedelta(seconds=LOCK_EXPIRE)
+    return Q(locked_by__isnull=True) | Q(locked_at__lt=expired)
+
+
+def claim_batches(token, limit):
+    '''
+    Claims up to ``limit`` unlocked (or expired) NoticeQueueBatch rows for
+    ``token`` and returns their ids.
+
+    Each claim is a conditional UPDATE on the batch row, so two consumers can
+    never claim the same batch. This works on every database, SQLite included,
+    without relying on SELECT ... FOR UPDATE.
+    '''
+    candidates = NoticeQueueBatch.objects.filter(_claimable()).order_by("id")
+    claimed = []
+    for batch_id in candidates.values_list("id", flat=True)[:limit]:
+        updated = NoticeQueueBatch.objects.filter(_claimable(), pk=batch_id)\
+                                          .update(locked_by=token,
+                                                  locked_at=timezone.now())
+        if updated:
+            claimed.append(batch_id)
+    return claimed
+
+
+def emit_batch(batch_id, token):
+    '''
+    Sends every notice of a claimed batch and deletes it. Returns the number
+    of notices sent.
+    '''
+    try:
+        batch = NoticeQueueBatch.objects.get(pk=batch_id, locked_by=token)
+    except NoticeQueueBatch.DoesNotExist:
+        # the lock expired and another consumer took the batch over
+        return 0
+    sent = 0
+    for label, extra_context, on_site, sender, user_ids, media, throttled in payload.decode(batch.pickled_data):
+        for chunk in chunked(user_ids, SETTINGS_CHUNK_SIZE):
+            users = User.objects.filter(pk__in=chunk)
+            send_now(users, label, dict(extra_context), sender, media=media,
+                     throttled=throttled)
+            sent += len(chunk)
+    NoticeQueueBatch.objects.filter(pk=batch_id, locked_by=token).delete()
+    return sent
+
+
+def _init_worker():
+    # never share the parent's database connection with a forked worker
+    connection.close()
+
+
+def _emit_batch(args):
+    batch_id, token = args
+    try:
+        return batch_id, emit_batch(batch_id, token), None
+    except Exception, e:
+        logger.exception("emitting notice batch %s failed" % batch_id)
+        return batch_id, 0, repr(e)
+
+
+def send_all(workers=1, max_seconds=None, max_batches=None, wait=None):
+    '''
+    Drains the NoticeQueueBatch table.
+
+    workers: number of worker processes (1 runs everything in this process).
+    max_seconds: stop claiming new batches after this many seconds.
+    max_batches: stop after this many batches were claimed.
+    wait: when the queue is empty sleep this many seconds and look again
+          instead of returning (long-lived daemon mode).
+
+    Batches that fail keep their lock and are retried by any consumer once
+    NOTIFICATION_LOCK_EXPIRE has passed.
+
+    Returns a dict of counters: batches, notices, failed, seconds,
+    notices_per_second and batches_per_second.
+    '''
+    token = get_lock_token()
+    started = time.time()
+    stats = {"batches": 0, "notices": 0, "failed": 0}
+    pool = None
+    if workers > 1:
+        connection.close()
+        pool = Pool(workers, initializer=_init_worker)
+
+    try:
+        while True:
+            if max_seconds is not None and time.time() - started >= max_seconds:
+                break
+            # claim a couple of batches per worker so none of them idles
+            limit = workers * 2
+            if max_batches is not None:
+                limit = min(limit, max_batches - stats["batches"] - stats["failed"])
+            if limit <= 0:
+                break
+            batch_ids = claim_batches(token, limit)
+            if not batch_ids:
+                if wait is None:
+                    break
+                time.sleep(wait)
+                continue
+            jobs = [(batch_id, token) for batch_id in batch_ids]
+            if pool is not None:
+                results = pool.imap_unordered(_emit_batch, jobs)
+            else:
+                results = (_emit_batch(job) for job in jobs)
+            for batch_id, sent, error in results:
+                if error is None:
+                    stats["batches"] += 1
+                    stats["notices"] += sent
+                else:
+                    stats["failed"] += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - started
+    stats["seconds"] = elapsed
+    stats["notices_per_second"] = stats["notices"] / elapsed if elapsed else 0.0
+    stats["batches_per_second"] = stats["batches"] / elapsed if elapsed else 0.0
+    logger.info("emitted %(notices)s notices in %(batches)s batches "
+                "(%(failed)s failed) in %(seconds).2fs" % stats)
+    return stats
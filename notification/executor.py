@@ -0,0 +1,154 @@
+'''
+In-process background delivery used by send() when NOTIFICATION_THREAD_SEND_NOW
+is enabled (the default). send() then returns a DeliveryHandle before the
+notices are delivered: wait on it, or call executor.join() to wait for every
+send submitted so far.
+
+NOTIFICATION_THREAD_WORKERS( = 2) number of delivery threads.
+NOTIFICATION_THREAD_QUEUE_SIZE( = 100) number of sends waiting for a thread
+before the overflow policy applies.
+NOTIFICATION_THREAD_OVERFLOW( = "block") what send() does when the queue is
+full: "block" waits for room, "queue" stores the notices in NoticeQueueBatch
+for emit_notices and "raise" raises DeliveryQueueFull.
+'''
+# Python Core
+import atexit
+import logging
+import os
+import threading
+import Queue
+
+# Django
+from django.conf import settings
+from django.db import connection
+
+THREAD_WORKERS = getattr(settings, "NOTIFICATION_THREAD_WORKERS", 2)
+THREAD_QUEUE_SIZE = getattr(settings, "NOTIFICATION_THREAD_QUEUE_SIZE", 100)
+THREAD_OVERFLOW = getattr(settings, "NOTIFICATION_THREAD_OVERFLOW", "block")
+
+logger = logging.getLogger("notification")
+
+
+class DeliveryQueueFull(Exception):
+    pass
+
+
+class DeliveryHandle(object):
+    '''
+    Returned by DeliveryExecutor.submit. Use wait() or get() to block until the
+    delivery is done (mostly useful in tests).
+    '''
+    def __init__(self):
+        self._event = threading.Event()
+        self.result = None
+        self.exception = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until the delivery is done or timeout expires. Returns done().
+        '''
+        self._event.wait(timeout)
+        return self.done()
+
+    def get(self, timeout=None):
+        '''
+        Returns the result of the delivery, re-raising its exception if any.
+        '''
+        if not self.wait(timeout):
+            raise RuntimeError("Delivery did not complete in %s seconds" % timeout)
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+    def finish(self, result=None, exception=None):
+        self.result = result
+        self.exception = exception
+        self._event.set()
+
+
+class DeliveryExecutor(object):
+    '''
+    A bounded pool of daemon threads running deliveries. Threads are started
+    on the first submit and drained when the process exits.
+    '''
+    def __init__(self, workers=THREAD_WORKERS, queue_size=THREAD_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._threads = []
+        self._queue = None
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            # a forked process (emit_notices workers...) does not inherit threads
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue.Queue(self.queue_size)
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work,
+                                     name="notification-delivery-%s" % i)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                handle, func, args, kwargs = item
+                try:
+                    handle.finish(result=func(*args, **kwargs))
+                except Exception, e:
+                    logger.exception("background notification delivery failed")
+                    handle.finish(exception=e)
+                finally:
+                    # connections are per thread, don't leave one open while idle
+                    connection.close()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Schedules func(*args, **kwargs) and returns a DeliveryHandle. Blocks
+        while the queue is full when ``block`` (default True) else raises
+        DeliveryQueueFull.
+        '''
+        block = kwargs.pop("block", True)
+        self._start()
+        handle = DeliveryHandle()
+        try:
+            self._queue.put((handle, func, args, kwargs), block)
+        except Queue.Full:
+            raise DeliveryQueueFull("%s deliveries already waiting" % self.queue_size)
+        return handle
+
+    def join(self):
+        '''
+        Waits until every submitted delivery is done.
+        '''
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def shutdown(self):
+        '''
+        Delivers everything still queued, then stops the threads.
+        '''
+        if self._pid != os.getpid():
+            return
+        for t in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._pid = None
+
+
+executor = DeliveryExecutor()
+atexit.register(executor.shutdown)
@@ -0,0 +1,44 @@
+# Django
+from django.db import models
+
+# PickleField
+from picklefield.fields import dbsafe_decode
+
+# This app
+from notification import serialization
+
+
+class NoticeDataField(models.TextField):
+    '''
+    Stores a value (the extra_context of a notice) as JSON with model
+    instances saved as references, see notification.serialization.
+
+    Values pickled by the PickledObjectField used up to 0.2 are still read
+    until migration 0008 has rewritten them.
+    '''
+    __metaclass__ = models.SubfieldBase
+
+    def to_python(self, value):
+        if not isinstance(value, basestring):
+            return value
+        if value[:1] in ("{", "["):
+            return serialization.loads(value)
+        try:
+            return dbsafe_decode(value)
+        except Exception:
+            return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return serialization.dumps(value)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self._get_val_from_obj(obj))
+
+
+try:
+    from south.modelsinspector import add_introspection_rules
+    add_introspection_rules([], [r"^notification\.fields\.NoticeDataField"])
+except ImportError:
+    pass
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from notification.engine import send_all
+
+
+class Command(BaseCommand):
+
+    help = 'emits the notices queued in NoticeQueueBatch'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--workers", type="int", dest="workers", default=1,
+                    help="number of worker processes (default 1)"),
+        make_option("--max-seconds", type="int", dest="max_seconds", default=None,
+                    help="stop claiming batches after this many seconds"),
+        make_option("--max-batches", type="int", dest="max_batches", default=None,
+                    help="stop after this many batches"),
+        make_option("--wait", type="int", dest="wait", default=None,
+                    help="keep running and poll the queue every WAIT seconds "
+                         "once it is empty"),
+    )
+
+    def handle(self, *args, **options):
+        stats = send_all(workers=max(options["workers"], 1),
+                         max_seconds=options["max_seconds"],
+                         max_batches=options["max_batches"],
+                         wait=options["wait"])
+        self.stdout.write("%(notices)s notices in %(batches)s batches "
+                          "(%(failed)s failed) in %(seconds).2fs: "
+                          "%(notices_per_second).1f notices/s, "
+                          "%(batches_per_second).2f batches/s\n" % stats)
@@ -0,0 +1,128 @@
+import gzip
+import json
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from notification.backends.website import Notice, reset_unseen_count
+
+EXPORT_FIELDS = ("id", "recipient", "notice_type", "added", "unseen", "archived",
+                 "content_type", "object_id", "data")
+
+
+class Command(BaseCommand):
+
+    help = 'deletes old notices according to the given retention policies'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--archived-older-than", type="int", dest="archived_days", default=None,
+                    help="delete archived notices added more than DAYS days ago"),
+        make_option("--max-age", type="int", dest="max_age", default=None,
+                    help="delete notices added more than MAX_AGE days ago"),
+        make_option("--max-per-user", type="int", dest="max_per_user", default=None,
+                    help="keep only the MAX_PER_USER newest notices of each user"),
+        make_option("--batch-size", type="int", dest="batch_size", default=1000,
+                    help="width of the id ranges deleted per query (default 1000)"),
+        make_option("--export", dest="export", default=None,
+                    help="append the deleted notices to this gzipped jsonl file first"),
+        make_option("--dry-run", action="store_true", dest="dry_run", default=False,
+                    help="only report how many notices each policy would delete"),
+    )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.dry_run = options["dry_run"]
+        now = timezone.now()
+
+        policies = []
+        if options["archived_days"] is not None:
+            cutoff = now - timedelta(days=options["archived_days"])
+            policies.append(("archived-older-than",
+                             Notice.objects.filter(archived=True, added__lt=cutoff)))
+        if options["max_age"] is not None:
+            cutoff = now - timedelta(days=options["max_age"])
+            policies.append(("max-age", Notice.objects.filter(added__lt=cutoff)))
+        if not policies and options["max_per_user"] is None:
+            raise CommandError("Give at least one of --archived-older-than, "
+                               "--max-age or --max-per-user")
+
+        self.export = None
+        if options["export"] and not self.dry_run:
+            self.export = gzip.open(options["export"], "ab")
+        try:
+            for name, notices in policies:
+                self.report(name, self.prune_range(notices))
+            if options["max_per_user"] is not None:
+                self.report("max-per-user", self.prune_per_user(options["max_per_user"]))
+        finally:
+            if self.export is not None:
+                self.export.close()
+
+    def report(self, policy, count):
+        verb = "would delete" if self.dry_run else "deleted"
+        self.stdout.write("%s: %s %s notices\n" % (policy, verb, count))
+
+    def prune_range(self, notices):
+        '''
+        Deletes notices walking the primary key in ranges of batch_size so
+        every query only locks a bounded slice of the table.
+        '''
+        if self.dry_run:
+            return notices.count()
+        bounds = notices.aggregate(low=Min("id"), high=Max("id"))
+        if bounds["low"] is None:
+            return 0
+        deleted = 0
+        for low in xrange(bounds["low"], bounds["high"] + 1, self.batch_size):
+            deleted += self.delete(notices.filter(id__gte=low, id__lt=low + self.batch_size))
+        return deleted
+
+    def prune_per_user(self, limit):
+        over = (Notice.objects.order_by()
+                              .values_list("recipient")
+                              .annotate(total=Count("id"))
+                              .filter(total__gt=limit))
+        if self.dry_run:
+            return sum(count - limit for recipient_id, count in over)
+        deleted = 0
+        for recipient_id, count in over:
+            ids = list(Notice.objects.filter(recipient=recipient_id)
+                                     .order_by("-added", "-id")
+                                     .values_list("id", flat=True)[limit:])
+            for start in xrange(0, len(ids), self.batch_size):
+                deleted += self.delete(Notice.objects.filter(
+                    id__in=ids[start:start + self.batch_size]))
+        return deleted
+
+    def delete(self, notices):
+        '''
+        Exports then deletes one batch of notices. Returns the number deleted.
+        '''
+        if self.export is not None:
+            rows = list(notices.values(*EXPORT_FIELDS))
+            for row in rows:
+                self.export.write(json.dumps(export_row(row), separators=(",", ":")) + "\n")
+            self.export.flush()
+            ids = [row["id"] for row in rows]
+            recipient_ids = set(row["recipient"] for row in rows)
+        else:
+            rows = list(notices.values_list("id", "recipient"))
+            ids = [notice_id for notice_id, recipient_id in rows]
+            recipient_ids = set(recipient_id for notice_id, recipient_id in rows)
+        if not ids:
+            return 0
+        Notice.objects.filter(id__in=ids).delete()
+        reset_unseen_count(*recipient_ids)
+        return len(ids)
+
+
+def export_row(row):
+    row = dict(row)
+    row["added"] = row["added"].isoformat()
+    # data is json already, unless the row predates migration 0008
+    if row["data"][:1] in ("{", "["):
+        row["data"] = json.loads(row["data"])
+    return row
@@ -0,0 +1,50 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from notification import caching
+from notification.backends.website import (Notice, unseen_count_key,
+                                           UNSEEN_COUNT_TIMEOUT)
+
+
+class Command(BaseCommand):
+
+    help = 'recounts the cached unseen notice counters that drifted'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", type="int", dest="chunk_size", default=1000,
+                    help="number of users checked per query (default 1000)"),
+    )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        last_pk = 0
+        checked = repaired = 0
+        while True:
+            user_ids = list(User.objects.filter(pk__gt=last_pk).order_by("pk")
+                                        .values_list("pk", flat=True)[:chunk_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            # only users with a cached counter can have drifted
+            keys = dict((unseen_count_key(pk), pk) for pk in user_ids)
+            cached = caching.cache.get_many(keys.keys())
+            if not cached:
+                continue
+            counts = dict(Notice.objects.filter(recipient__in=[keys[key] for key in cached],
+                                                unseen=True, archived=False)
+                                        .order_by()
+                                        .values_list("recipient")
+                                        .annotate(Count("id")))
+            fixed = {}
+            for key, value in cached.items():
+                count = counts.get(keys[key], 0)
+                checked += 1
+                if value != count:
+                    fixed[key] = count
+            if fixed:
+                caching.cache.set_many(fixed, UNSEEN_COUNT_TIMEOUT)
+                repaired += len(fixed)
+        self.stdout.write("%s cached counters checked, %s repaired\n" % (checked, repaired))
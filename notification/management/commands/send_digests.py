@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notification.digest import send_digests, CHUNK_SIZE
+from notification.models import DIGEST_FREQUENCIES
+
+
+class Command(BaseCommand):
+
+    help = 'emails the pending notice digests of the given frequency'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--frequency", dest="frequency", default=None,
+                    help="%s, run it from cron at that interval" % " or ".join(DIGEST_FREQUENCIES)),
+        make_option("--chunk-size", type="int", dest="chunk_size", default=CHUNK_SIZE,
+                    help="number of users handled per query (default %s)" % CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        if options["frequency"] not in DIGEST_FREQUENCIES:
+            raise CommandError("--frequency must be one of %s" % ", ".join(DIGEST_FREQUENCIES))
+        stats = send_digests(options["frequency"], chunk_size=options["chunk_size"])
+        self.stdout.write("%(items)s notices sent to %(users)s users in digests "
+                          "(%(failed)s failed)\n" % stats)
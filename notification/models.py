@@ -1,5 +1,9 @@
+# Python Core
+import logging
+from datetime import timedelta
+
 # Django
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import get_language, activate, ugettext_lazy as _
 from django.contrib.auth.models import User
@@ -10,20 +14,24 @@ from django.core.urlresolvers import reverse
 from django.core.signing import Signer
 from django.core.urlresolvers import resolve
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.db.models.query import QuerySet
+from django.utils import timezone
 
 # Django Apps
 from django.contrib.sites.models import Site
 
 # This app
-from notification import backends
+from notification import backends, delivery, executor, payload, throttle
+from notification.preferences import HOURLY, DAILY, DIGEST_FREQUENCIES
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+logger = logging.getLogger("notification")
+
 QUEUE_ALL = getattr(settings, "NOTIFICATION_QUEUE_ALL", False)
 THREAD_SEND_NOW = getattr(settings, "NOTIFICATION_THREAD_SEND_NOW", True)
 
@@ -41,7 +49,7 @@ class NoticeType(models.Model):
     Stores a Notice class. Every notification sent out must belong to a
     specific class.
     '''
-    label = models.CharField(_("label"), max_length=40)
+    label = models.CharField(_("label"), max_length=40, unique=True)
     display = models.CharField(_("display"), max_length=50)
     description = models.CharField(_("description"), max_length=100)
     # The nitice of this type will only get sent using a medium with span
@@ -56,6 +64,60 @@ class NoticeType(models.Model):
         verbose_name_plural = _("notice types")
 
 
+'''
+NOTIFICATION_SHARED_REGISTRY( = False) also invalidate the NoticeType registry of
+other processes and nodes through Django's cache framework. Costs one cache get
+per lookup instead of none.
+'''
+SHARED_REGISTRY = getattr(settings, "NOTIFICATION_SHARED_REGISTRY", False)
+REGISTRY_VERSION_KEY = "notification.notice_types.version"
+
+_notice_types = {"version": None, "types": None}
+
+
+def _registry_version():
+    if not SHARED_REGISTRY:
+        return None
+    from notification import caching
+    return caching.get_generation(REGISTRY_VERSION_KEY)
+
+
+def get_notice_types():
+    '''
+    Returns a {label: NoticeType} dictionary of all notice types, loaded once
+    per process and reloaded when a NoticeType is saved or deleted.
+    '''
+    version = _registry_version()
+    types = _notice_types["types"]
+    if types is None or _notice_types["version"] != version:
+        types = dict((nt.label, nt) for nt in NoticeType.objects.order_by("id"))
+        _notice_types.update({"version": version, "types": types})
+    return types
+
+
+def get_notice_type(label):
+    '''
+    Same as NoticeType.objects.get(label=label) without a query once the
+    registry is loaded. Raises NoticeType.DoesNotExist for unknown labels.
+    '''
+    try:
+        return get_notice_types()[label]
+    except KeyError:
+        # may have been created by another process without a shared registry
+        notice_type = NoticeType.objects.get(label=label)
+        _notice_types["types"] = None
+        return notice_type
+
+
+@receiver(post_save, sender=NoticeType)
+@receiver(post_delete, sender=NoticeType)
+def invalidate_notice_types(sender, **kwargs):
+    _notice_types["types"] = None
+    if SHARED_REGISTRY:
+        from notification import caching
+        caching.bump_generation(REGISTRY_VERSION_KEY)
+
+
 # XXX These lines must come AFTER NoticeType is defined
 # key is a tuple (medium_id, backend_label)
 NOTIFICATION_BACKENDS = backends.load_backends()
@@ -100,16 +162,29 @@ def create_notice_type(label, display, description, default=2, verbosity=1):
             print "Created %s NoticeType" % label
 
 
+# HOURLY, DAILY and DIGEST_FREQUENCIES come from notification.preferences,
+# which packs them in the cached settings
+IMMEDIATE = "immediate"
+FREQUENCIES = (
+    (IMMEDIATE, _("immediately")),
+    (HOURLY, _("hourly digest")),
+    (DAILY, _("daily digest")),
+)
+
+
 class NoticeSetting(models.Model):
     '''
     Object that indicates, for a given user, whether to send notifications
-    of a given NoticeType using a given medium.
+    of a given NoticeType using a given medium, and for media supporting it
+    whether to send them right away or in a periodic digest.
     '''
 
     user = models.ForeignKey(User, verbose_name=_("user"))
     notice_type = models.ForeignKey(NoticeType, verbose_name=_("notice type"))
     medium = models.CharField(_("medium"), max_length=1, choices=NOTICE_MEDIA)
     send = models.BooleanField(_("send"))
+    frequency = models.CharField(_("frequency"), max_length=10, choices=FREQUENCIES,
+                                 default=IMMEDIATE)
 
     class Meta:
         verbose_name = _("notice setting")
@@ -117,6 +192,22 @@ class NoticeSetting(models.Model):
         unique_together = ("user", "notice_type", "medium")
 
 
+class NoticeMute(models.Model):
+    '''
+    Marks a medium as muted for a user (unsubscribed): nothing is sent to the
+    user through it whatever the NoticeSettings say.
+    '''
+
+    user = models.ForeignKey(User, verbose_name=_("user"))
+    medium = models.CharField(_("medium"), max_length=1, choices=NOTICE_MEDIA)
+    added = models.DateTimeField(_("added"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("muted medium")
+        verbose_name_plural = _("muted media")
+        unique_together = ("user", "medium")
+
+
 
 def get_notification_setting(user, notice_type, medium):
     try:
@@ -133,7 +224,244 @@ def get_notification_setting(user, notice_type, medium):
 
 
 def should_send(user, notice_type, medium):
-    return get_notification_setting(user, notice_type, medium).send
+    user_id = getattr(user, "pk", user)
+    key = (notice_type.id, str(medium))
+    matrix = _get_user_notice_settings([user_id], [key, (MUTED, str(medium))])[user_id]
+    return not matrix[(MUTED, str(medium))] and matrix[key]
+
+
+'''
+NOTIFICATION_SETTINGS_CHUNK_SIZE( = 500) maximum number of user ids placed in a
+single IN clause when resolving notice settings for many users at once.
+'''
+SETTINGS_CHUNK_SIZE = getattr(settings, "NOTIFICATION_SETTINGS_CHUNK_SIZE", 500)
+
+
+def chunked(items, size):
+    '''
+    Yields successive lists of at most ``size`` elements from ``items``.
+    '''
+    items = list(items)
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_notification_settings(users, notice_type, media=None):
+    '''
+    Bulk version of get_notification_setting.
+
+    Returns a send map of the form {medium_id: {user_id: send}} for the given
+    notice_type, read from the preference cache (notification.preferences)
+    and loaded for the users missing from it by get_user_notice_settings.
+    Users who muted a medium are never sent to through it. send is the digest
+    frequency (HOURLY or DAILY) instead of True for users who chose one.
+    '''
+    if media is None:
+        media = NOTICE_MEDIA_DEFAULTS.keys()
+    media = [str(medium) for medium in media]
+    user_ids = set(getattr(user, "pk", user) for user in users)
+    keys = [(notice_type.id, medium) for medium in media]
+    keys += [(MUTED, medium) for medium in media]
+    matrices = _get_user_notice_settings(user_ids, keys)
+    return dict((medium, dict((user_id, not matrix[(MUTED, medium)] and
+                                        matrix[(notice_type.id, medium)])
+                              for user_id, matrix in matrices.items()))
+                for medium in media)
+
+
+def _create_notice_settings(notice_settings):
+    '''
+    bulk_create the given NoticeSetting rows. If a concurrent send created some
+    of them in the meantime, fall back to creating the remaining rows one by one.
+    '''
+    sid = transaction.savepoint()
+    try:
+        NoticeSetting.objects.bulk_create(notice_settings)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        for ns in notice_settings:
+            NoticeSetting.objects.get_or_create(user_id=ns.user_id,
+                                                notice_type_id=ns.notice_type_id,
+                                                medium=ns.medium,
+                                                defaults={"send": ns.send})
+
+
+# pseudo notice type id under which the matrices hold the muted flag of
+# each medium (see NoticeMute)
+MUTED = 0
+
+
+def get_user_notice_settings(user):
+    '''
+    Returns the settings of user for every notice type and medium as a
+    {(notice_type_id, medium): send} dictionary, medium being the
+    NoticeSetting.medium string and send False, True or the digest frequency
+    (HOURLY or DAILY). (MUTED, medium) is True when the user muted the
+    medium. The returned dictionary is shared with the
+    preference cache and must not be modified.
+    '''
+    user_id = getattr(user, "pk", user)
+    keys = [(notice_type.id, str(medium_id))
+            for notice_type in get_notice_types().values()
+            for medium_id, medium_display in NOTICE_MEDIA]
+    keys += [(MUTED, str(medium_id)) for medium_id, medium_display in NOTICE_MEDIA]
+    return _get_user_notice_settings([user_id], keys)[user_id]
+
+
+def _get_user_notice_settings(user_ids, keys):
+    '''
+    Returns {user_id: matrix} from the preference cache. Users missing from
+    it, or whose cached matrix lacks one of the (notice_type_id, medium) keys
+    (new notice types), are loaded with one query per chunk of users and the
+    result cached. Settings without a row are filled in from the defaults;
+    rows are only created (one bulk_create per chunk) for the requested keys,
+    the other defaults live in the cached matrix until the user changes them
+    (see set_user_notice_settings).
+    '''
+    from notification import preferences
+    matrices = preferences.get_many(user_ids)
+    stale = [user_id for user_id in user_ids
+             if user_id not in matrices or
+                any(key not in matrices[user_id] for key in keys)]
+    if not stale:
+        return matrices
+
+    notice_types = dict((nt.id, nt) for nt in get_notice_types().values())
+    unknown = set(notice_type_id for notice_type_id, medium in keys) - set(notice_types)
+    unknown.discard(MUTED)
+    if unknown:
+        # created by another process since the registry was loaded
+        notice_types.update(NoticeType.objects.in_bulk(list(unknown)))
+    # read before the rows: an invalidate during the load makes it stale
+    generations = preferences.get_generations(stale)
+    loaded = {}
+    for chunk in chunked(stale, SETTINGS_CHUNK_SIZE):
+        for user_id in chunk:
+            loaded[user_id] = dict(((MUTED, str(medium_id)), False)
+                                   for medium_id, medium_display in NOTICE_MEDIA)
+        rows = NoticeSetting.objects.filter(user__in=chunk)
+        for user_id, notice_type_id, medium, send, frequency in rows.values_list(
+                "user", "notice_type", "medium", "send", "frequency"):
+            if send and frequency in DIGEST_FREQUENCIES:
+                send = frequency
+            loaded[user_id][(notice_type_id, medium)] = send
+        mutes = NoticeMute.objects.filter(user__in=chunk).values_list("user", "medium")
+        for user_id, medium in mutes:
+            loaded[user_id][(MUTED, medium)] = True
+
+        requested = set(keys)
+        missing = []
+        for notice_type in notice_types.values():
+            for medium_id, medium_display in NOTICE_MEDIA:
+                medium = str(medium_id)
+                default = NOTICE_MEDIA_DEFAULTS[medium_id] <= notice_type.default
+                for user_id in chunk:
+                    if (notice_type.id, medium) in loaded[user_id]:
+                        continue
+                    loaded[user_id][(notice_type.id, medium)] = default
+                    if (notice_type.id, medium) in requested:
+                        missing.append(NoticeSetting(user_id=user_id,
+                                                     notice_type=notice_type,
+                                                     medium=medium,
+                                                     send=default))
+        if missing:
+            _create_notice_settings(missing)
+    preferences.set_many(loaded, generations)
+    matrices.update(loaded)
+    return matrices
+
+
+def set_user_notice_settings(user, changes):
+    '''
+    Saves a {(notice_type_id, medium): send} dictionary of changed settings
+    with one UPDATE per (medium, send) pair, send being False, True (sent
+    immediately) or a digest frequency. Turning a notice type on for a
+    muted medium unmutes it. Returns the number of rows updated.
+    '''
+    user_id = getattr(user, "pk", user)
+    groups = {}
+    for (notice_type_id, medium), send in changes.items():
+        groups.setdefault((str(medium), send), []).append(notice_type_id)
+    # settings still at their default may have no row yet
+    existing = set(NoticeSetting.objects.filter(user=user_id)
+                                        .values_list("notice_type", "medium"))
+    notice_types = dict((nt.id, nt) for nt in get_notice_types().values())
+    missing = [NoticeSetting(user_id=user_id, notice_type_id=notice_type_id,
+                             medium=str(medium),
+                             send=NOTICE_MEDIA_DEFAULTS[int(medium)] <=
+                                  notice_types[notice_type_id].default)
+               for notice_type_id, medium in changes
+               if (notice_type_id, str(medium)) not in existing and
+                  notice_type_id in notice_types]
+    if missing:
+        _create_notice_settings(missing)
+    updated = 0
+    for (medium, send), notice_type_ids in groups.items():
+        if not send:
+            values = {"send": False}
+        elif send in DIGEST_FREQUENCIES:
+            values = {"send": True, "frequency": send}
+        else:
+            values = {"send": True, "frequency": IMMEDIATE}
+        updated += NoticeSetting.objects.filter(user=user_id,
+                                                medium=medium,
+                                                notice_type__in=notice_type_ids
+                                                ).update(**values)
+    enabled = [medium for medium, send in groups if send]
+    if enabled:
+        NoticeMute.objects.filter(user=user_id, medium__in=enabled).delete()
+    invalidate_user_notice_settings(user_id)
+    return updated
+
+
+def unsubscribe_user(user, medium):
+    '''
+    Mutes medium for user and turns off every notice type for it: one UPDATE
+    of the existing settings and one bulk_create of explicit opt-out rows for
+    the notice types the user has no setting for yet, so defaults created
+    later can't switch the medium back on.
+    '''
+    user_id = getattr(user, "pk", user)
+    medium = str(medium)
+    existing = set(NoticeSetting.objects.filter(user=user_id, medium=medium)
+                                        .values_list("notice_type", flat=True))
+    missing = [NoticeSetting(user_id=user_id, notice_type=notice_type,
+                             medium=medium, send=False)
+               for notice_type in get_notice_types().values()
+               if notice_type.id not in existing]
+    if missing:
+        _create_notice_settings(missing)
+    NoticeSetting.objects.filter(user=user_id, medium=medium).update(send=False)
+    NoticeMute.objects.get_or_create(user_id=user_id, medium=medium)
+    # pending digests of the medium must not be sent either
+    if any(key[0] == int(medium) and backend.supports_digest
+           for key, backend in NOTIFICATION_BACKENDS.items()):
+        DigestItem.objects.filter(user=user_id).delete()
+    invalidate_user_notice_settings(user_id)
+
+
+def resubscribe_user(user, medium):
+    '''
+    Unmutes medium for user. The per notice type settings are left as they
+    are.
+    '''
+    user_id = getattr(user, "pk", user)
+    NoticeMute.objects.filter(user=user_id, medium=str(medium)).delete()
+    invalidate_user_notice_settings(user_id)
+
+
+def invalidate_user_notice_settings(*user_ids):
+    from notification import preferences
+    preferences.invalidate(*user_ids)
+
+
+@receiver(post_save, sender=NoticeSetting)
+@receiver(post_delete, sender=NoticeSetting)
+@receiver(post_save, sender=NoticeMute)
+@receiver(post_delete, sender=NoticeMute)
+def notice_setting_changed(sender, instance, **kwargs):
+    invalidate_user_notice_settings(instance.user_id)
 
 
 class LanguageStoreNotAvailable(Exception):
@@ -158,14 +486,49 @@ def get_notification_language(user):
     raise LanguageStoreNotAvailable
 
 
-def broadcast(label, extra_context=None, sender=None, exclude=None):
-    '''Brodcasts a notification for all the users on the system.'''
+'''
+NOTIFICATION_BROADCAST_CHUNK_SIZE( = 1000) number of users loaded and sent to
+at a time by broadcast.
+'''
+BROADCAST_CHUNK_SIZE = getattr(settings, "NOTIFICATION_BROADCAST_CHUNK_SIZE", 1000)
+
 
-    extra_context = extra_context or {}
-    exclude = exclude or []
-    send_to = set(User.objects.all()) - set(exclude)
+def broadcast(label, extra_context=None, sender=None, exclude=None, progress=None):
+    '''
+    Brodcasts a notification for all the users on the system.
 
-    send(send_to, label, extra_context, sender)
+    Users are read in primary key order, BROADCAST_CHUNK_SIZE at a time, with
+    the exclusion done by the database, and every chunk is handed to send().
+    Memory use does not depend on the number of users.
+
+    exclude: users (or user ids, or a User QuerySet) not to notify.
+    progress: optional callable(chunks, users) called after each chunk.
+    Returns the number of users reached.
+    '''
+    extra_context = extra_context or {}
+    users = User.objects.order_by("pk")
+    if isinstance(exclude, QuerySet):
+        users = users.exclude(pk__in=exclude.values("pk"))
+    elif exclude:
+        users = users.exclude(pk__in=[getattr(user, "pk", user) for user in exclude])
+
+    chunks = reached = 0
+    last_pk = None
+    while True:
+        chunk = users
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:BROADCAST_CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        send(chunk, label, extra_context, sender=sender)
+        chunks += 1
+        reached += len(chunk)
+        logger.info("broadcast %s: %s chunks, %s users" % (label, chunks, reached))
+        if progress is not None:
+            progress(chunks, reached)
+    return reached
 
 def get_sender_path(extra_context, sender):
         '''
@@ -195,13 +558,15 @@ def get_sender_path(extra_context, sender):
                 sender_path = ""
         return sender_path  
 
-import threading
 def send(*args, **kwargs):
     """
     A basic interface around both queue and send_now. This honors a global
     flag NOTIFICATION_QUEUE_ALL that helps determine whether all calls should
     be queued or not. A per call ``queue`` or ``now`` keyword argument can be
     used to always override the default global behavior.
+
+    With NOTIFICATION_THREAD_SEND_NOW send_now runs on a background thread (see
+    notification.executor) and a DeliveryHandle is returned.
     """
     queue_flag = kwargs.pop("queue", False)
     now_flag = kwargs.pop("now", False)
@@ -215,12 +580,15 @@ def send(*args, **kwargs):
             now_flag = True
             
     if now_flag and THREAD_SEND_NOW:
-        print '-threading'
-        t = threading.Thread(target=send_now(*args, **kwargs), args=[None])
-        # We want the program to wait on this thread before shutting down.
-        t.setDaemon(False)
-        t.start()
-        return 'sending'
+        block = executor.THREAD_OVERFLOW == "block"
+        try:
+            return executor.executor.submit(send_now, block=block, *args, **kwargs)
+        except executor.DeliveryQueueFull:
+            if executor.THREAD_OVERFLOW != "queue":
+                raise
+            handle = executor.DeliveryHandle()
+            handle.finish(result=queue(*args, **kwargs))
+            return handle
     else:
         return send_now(*args, **kwargs)
 
@@ -228,29 +596,85 @@ class NoticeQueueBatch(models.Model):
     """
     A queued notice.
     Denormalized data for a notice.
+
+    pickled_data is written by notification.payload.encode.
+    locked_by & locked_at are set by the emit_notices command while a worker
+    is processing the batch (see notification.engine).
     """
     pickled_data = models.TextField()
-            
+    locked_by = models.CharField(max_length=64, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
 
-def queue(users, label, extra_context=None, on_site=True, sender=None):
+
+def queue(users, label, extra_context=None, on_site=True, sender=None,
+          media=None, delay=None, throttled=True):
     """
     Queue the notification in NoticeQueueBatch. This allows for large amounts
     of user notifications to be deferred to a seperate process running outside
     the webserver.
+
+    media: only send through these backends (labels).
+    delay: the emit_notices command won't send it for this many seconds.
+    throttled: apply NOTIFICATION_THROTTLE when it is sent.
     """
     if extra_context is None:
         extra_context = {}
     if isinstance(users, QuerySet):
-        users = [row["pk"] for row in users.values("pk")]
+        users = users.values_list("pk", flat=True)
     else:
         users = [user.pk for user in users]
-    notices = []
-    for user in users:
-        notices.append((user, label, extra_context, on_site, sender))
-    NoticeQueueBatch(pickled_data=pickle.dumps(notices).encode("base64")).save()
+    data = payload.encode(users, label, extra_context, on_site, sender,
+                          media=media, throttled=throttled)
+    batch = NoticeQueueBatch(pickled_data=data)
+    if delay:
+        from notification.engine import LOCK_EXPIRE
+        # held by a lock that expires once delay seconds have passed
+        batch.locked_by = "delayed"
+        batch.locked_at = timezone.now() + timedelta(seconds=delay - LOCK_EXPIRE)
+    batch.save()
+
+
+class DigestItem(models.Model):
+    """
+    A notice waiting to be emailed in a digest by the send_digests command
+    (see notification.digest). short, message_txt and message hold the
+    short.txt, full.txt & full.html fragments rendered when it was sent.
+    """
+    user = models.ForeignKey(User, verbose_name=_("user"))
+    notice_type = models.ForeignKey(NoticeType, verbose_name=_("notice type"))
+    frequency = models.CharField(_("frequency"), max_length=10, choices=FREQUENCIES)
+    added = models.DateTimeField(_("added"), auto_now_add=True)
+    short = models.TextField()
+    message_txt = models.TextField()
+    message = models.TextField()
+
+    class Meta:
+        # (frequency, user) is indexed by migration 0010
+        ordering = ["added", "id"]
+        verbose_name = _("digest item")
+        verbose_name_plural = _("digest items")
+
+
+'''
+NOTIFICATION_UNSUBSCRIBE_SCHEME( = "https") scheme of the unsubscribe links,
+mail providers only POST to one click unsubscribe (RFC 8058) urls over https.
+'''
+UNSUBSCRIBE_SCHEME = getattr(settings, "NOTIFICATION_UNSUBSCRIBE_SCHEME", "https")
+
+
+def get_unsubscribe_links(user, medium="email", signer=None):
+    '''
+    Returns the (unsubscribe page, one click unsubscribe) absolute urls of
+    user for medium (a backend label).
+    '''
+    args = [medium, (signer or Signer()).sign(user.pk)]
+    site_url = "%s://%s" % (UNSUBSCRIBE_SCHEME, Site.objects.get_current().domain)
+    return (site_url + reverse('notificaton_unsubscribe', args=args),
+            site_url + reverse('notification_one_click_unsubscribe', args=args))
 
 
-def send_now(users, label, extra_context=None, sender=None):
+def send_now(users, label, extra_context=None, sender=None, media=None,
+             throttled=True):
     '''
     Creates a new notice.
         This is intended to be how other apps create new notices:
@@ -259,63 +683,119 @@ def send_now(users, label, extra_context=None, sender=None):
     sender: should always be the object of interest to the users(recipiants)
         Example 1:  if a user is followed the sender should be the following user.
         Example 2:  if a blog entry is commented on the sender should be the blog entry.
+    media: only send through these backends (labels), default all of them.
+    throttled: apply NOTIFICATION_THROTTLE (False for the notices it delayed).
+
+    Recipients are handed to the backends' can_send_many and deliver_many
+    NOTIFICATION_SETTINGS_CHUNK_SIZE at a time.
+
+    Repeats of the same notice about the same sender are throttled per backend
+    according to NOTIFICATION_THROTTLE (see notification.throttle). With
+    NOTIFICATION_CONCURRENT_DELIVERY the backends other than website deliver
+    concurrently (see notification.delivery).
     '''
     
-    notice_type = NoticeType.objects.get(label=label)
+    notice_type = get_notice_type(label)
     current_language = get_language()
     extra_context = extra_context or {}
     notices_url = root_url + reverse("notification_notices")
     notice_settings_url = root_url + reverse("notification_notice_settings")
     sender_path = get_sender_path(extra_context, sender)
-   
+
+    # context saved with the website notices
+    notice_data = dict(extra_context)
+    if sender_path:
+        notice_data["sender_path"] = sender_path
+
+    # context that is the same for every recipient
+    shared_context = dict(notice_data)
+    shared_context.update({
+        "sender": sender,
+        "notice": notice_type,
+        "notices_url": notices_url,
+        "notice_settings_url": notice_settings_url,
+        "root_url": root_url,
+        "current_site": current_site,
+    })
+    if hasattr(sender, "_meta"):
+        shared_context["sender_type"] = ContentType.objects.get_for_model(sender).name
+
+    signer = Signer()
+    try:
+        # every backend gets the recipients SETTINGS_CHUNK_SIZE at a time
+        for chunk in chunked(users, SETTINGS_CHUNK_SIZE):
+            # resolve the chunk's settings for every medium up front, muted
+            # media included
+            preferences = get_notification_settings(chunk, notice_type)
+
+            #if website backend is present create all the notices at once.
+            notices = {}
+            if website and (media is None or "website" in media):
+                recipients = website.can_send_many(chunk, notice_type, preferences)
+                if throttled:
+                    recipients = throttle.apply("website", recipients, notice_type,
+                                                sender, extra_context)
+                notices = website.deliver_many(recipients, sender, notice_type,
+                                               notice_data)
+
+            per_user_context = _get_per_user_context(chunk, notices, sender_path,
+                                                     current_language, signer)
+
+            deliveries = []
+            for (medium_id, backend_label), backend in NOTIFICATION_BACKENDS.items():
+                if backend == website:
+                    continue
+                if media is not None and backend_label not in media:
+                    continue
+                recipients = backend.can_send_many(chunk, notice_type, preferences)
+                if throttled:
+                    recipients = throttle.apply(backend_label, recipients,
+                                                notice_type, sender, extra_context)
+                if delivery.CONCURRENT_DELIVERY:
+                    deliveries.append((backend_label, backend, recipients))
+                    continue
+                backend.deliver_many(recipients, sender, notice_type,
+                                     shared_context, per_user_context)
+            if deliveries:
+                delivery.deliver(deliveries, sender, notice_type, shared_context,
+                                 per_user_context)
+    finally:
+        # reset environment to original language
+        activate(current_language)
+
+
+def _get_per_user_context(users, notices, sender_path, default_language, signer):
+    '''
+    Returns {user_id: context} holding the recipient specific part of the
+    context of a send, notices being the website notices created for it.
+    '''
+    per_user_context = {}
     for user in users:
         try:
-            activate(get_notification_language(user))
+            language = get_notification_language(user)
         except LanguageStoreNotAvailable:
-            pass
+            language = default_language
 
-        # generate unsubscribe link    
-        signer = Signer()
-        args = ['email', signer.sign(user.pk)]
-        unsub_url = root_url + reverse('notificaton_unsubscribe', args=args)
+        # generate unsubscribe links, the one click link is POSTed to by
+        # mail clients (List-Unsubscribe header, RFC 8058)
+        unsub_url, one_click_url = get_unsubscribe_links(user, signer=signer)
 
-        # update context with user specific translations
         context = {
             "recipient": user,
-            "sender": sender,
-            "notice": notice_type,
-            "notices_url": notices_url,
-            "notice_settings_url": notice_settings_url,
-            "root_url": root_url,
-            "current_site": current_site,
             "unsubscribe_link": unsub_url,
+            "one_click_unsubscribe_link": one_click_url,
+            "LANGUAGE_CODE": language,
         }
-
-        #if website backend is present add context and save sender_path if provided.
-        if website and website.can_send(user, notice_type):
-            if sender_path:
-                #save sender_path to website db
-                extra_context.update({"sender_path":sender_path})
-            website.deliver(user, sender, notice_type, extra_context)
-            #website specific context
-            #make sender_url with view_sender (TODO: this may be unreliable, may need signal after saved)
-            notice = Notice.objects.latest('added')
-            extra_context.update({"sender_url":root_url+notice.get_sender_url()})
-            extra_context.update(notice.get_context())
-
+        notice = notices.get(user.pk)
+        if notice is not None:
+            #website specific context, sender_url goes through view_sender
+            context.update(notice.get_context())
+            context.update({"sender_url": root_url + notice.get_sender_url()})
         #if website is not present provide sender_url without view_sender.
         else:
-            extra_context.update({"notice_id": False, "sender_url": root_url+sender_path})
-        
-        #add context that we did not want to get saved in website db
-        extra_context.update(context)
-            
-        for backend in NOTIFICATION_BACKENDS.values():
-            if backend.can_send(user, notice_type) and backend != website:
-                backend.deliver(user, sender, notice_type, extra_context)
-
-    # reset environment to original language
-    activate(current_language)
+            context.update({"notice_id": False, "sender_url": root_url + sender_path})
+        per_user_context[user.pk] = context
+    return per_user_context
 
 
 class ObservedItemManager(models.Manager):
@@ -390,7 +870,7 @@ def observe(observed, observer, labels):
         labels = [labels]
     for label in labels:
         if not is_observing(observed, observer, label):
-            notice_type = NoticeType.objects.get(label=label)
+            notice_type = get_notice_type(label)
             observed_item = Observation(user=observer,
                                         observed_object=observed,
                                         notice_type=notice_type)
@@ -417,15 +897,31 @@ def send_observation_notices_for(observed, label, xcontext=None, exclude=None, s
     - alter_desc: determines if convert_to_observed_description occurs in template.
     optional kwargs:
     - sender: use to change the sender from the default observed object.
+
+    The observers are resolved with a single query (excluded users are
+    filtered out by the database) and the ones whose observation is enabled
+    are notified with one multi-recipient send.
     '''
-    xcontext = xcontext or {}
-    exclude = exclude or []
-    sent = []
+    extra_context = dict(xcontext or {})
     observations = Observation.objects.observers(observed, label)
-    for observation in observations:
-        if observation.user not in exclude:
-            observation.send_notice(xcontext, sender=sender)
-            sent.append(observation.user)
+    if exclude:
+        observations = observations.exclude(user__in=[getattr(user, "pk", user)
+                                                      for user in exclude])
+    observers = set()
+    recipients = set()
+    for user_id, send_flag in observations.values_list("user", "send"):
+        observers.add(user_id)
+        if send_flag:
+            recipients.add(user_id)
+    sent = list(User.objects.filter(pk__in=observers)) if observers else []
+    to_notify = [user for user in sent if user.pk in recipients]
+    if to_notify:
+        # same context as Observation.send_notice
+        if not sender:
+            sender = observed
+            extra_context.update({"alter_desc":True})
+        extra_context.update({"observed": observed})
+        send(to_notify, label, extra_context, sender=sender)
     # Return list of recipiants for exclusion from additional notifications.
     return sent
 
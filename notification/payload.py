@@ -0,0 +1,159 @@
+'''
+Encoding of the notices stored in NoticeQueueBatch.pickled_data.
+
+Version 1 (written by django-notification up to 0.2) is a base64 encoded
+pickle of a list of (user_pk, label, extra_context, on_site, sender) tuples,
+one per recipient.
+
+Version 2 stores the fields shared by every recipient once, the recipients
+as a delta/varint packed string of sorted primary keys and the sender as a
+(content_type_id, pk) reference instead of a pickled model instance. The
+result is optionally zlib compressed and written as "2:<base64>" (or
+"2z:<base64>" when compressed). Version 1 rows remain readable.
+'''
+# Python Core
+import logging
+import zlib
+
+# Django
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+'''
+NOTIFICATION_QUEUE_COMPRESS( = True) zlib compress queued batches.
+'''
+COMPRESS = getattr(settings, "NOTIFICATION_QUEUE_COMPRESS", True)
+
+VERSION = 2
+
+logger = logging.getLogger("notification")
+
+
+def pack_ids(ids):
+    '''
+    Packs integer primary keys as varint encoded deltas of their sorted values.
+    '''
+    out = bytearray()
+    previous = 0
+    for pk in sorted(set(ids)):
+        delta = pk - previous
+        previous = pk
+        while delta > 0x7f:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return str(out)
+
+
+def unpack_ids(data):
+    '''
+    Reverse of pack_ids.
+    '''
+    ids = []
+    previous = value = shift = 0
+    for byte in bytearray(data):
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += value
+            ids.append(previous)
+            value = shift = 0
+    return ids
+
+
+def _sender_ref(sender):
+    if sender is not None and hasattr(sender, "_meta") and sender.pk is not None:
+        content_type = ContentType.objects.get_for_model(sender)
+        return ("ref", content_type.id, sender.pk)
+    return ("obj", sender)
+
+
+def _resolve_sender(ref):
+    if ref[0] == "obj":
+        return ref[1]
+    content_type = ContentType.objects.get_for_id(ref[1])
+    return content_type.get_object_for_this_type(pk=ref[2])
+
+
+def encode(user_ids, label, extra_context, on_site, sender, compress=None,
+           media=None, throttled=True):
+    '''
+    Returns the version 2 text representation of a queued notice. media
+    restricts the backends (labels) it is sent through, throttled=False sends
+    it without applying NOTIFICATION_THROTTLE.
+    '''
+    if compress is None:
+        compress = COMPRESS
+    user_ids = list(user_ids)
+    if all(isinstance(pk, (int, long)) and pk >= 0 for pk in user_ids):
+        recipients = ("packed", pack_ids(user_ids))
+    else:
+        recipients = ("list", user_ids)
+    data = pickle.dumps({
+        "label": label,
+        "extra_context": extra_context,
+        "on_site": on_site,
+        "sender": _sender_ref(sender),
+        "recipients": recipients,
+        "media": media,
+        "throttled": throttled,
+    }, pickle.HIGHEST_PROTOCOL)
+    flags = ""
+    if compress:
+        data = zlib.compress(data)
+        flags = "z"
+    return "%d%s:%s" % (VERSION, flags, data.encode("base64"))
+
+
+def _decode_legacy(data):
+    notices = pickle.loads(data.decode("base64"))
+    jobs = []
+    for user_id, label, extra_context, on_site, sender in notices:
+        # consecutive notices written by a single queue() call share the same
+        # (unpickled once) context and sender objects
+        if jobs:
+            last = jobs[-1]
+            if (last[0] == label and last[1] is extra_context and
+                    last[2] == on_site and last[3] is sender):
+                last[4].append(user_id)
+                continue
+        jobs.append((label, extra_context, on_site, sender, [user_id], None, True))
+    return jobs
+
+
+def decode(data):
+    '''
+    Returns the notices stored in a batch, whatever its version, as a list of
+    (label, extra_context, on_site, sender, user_ids, media, throttled) jobs,
+    media being None unless the notice was queued for some backends only.
+
+    Jobs whose sender no longer exists are dropped.
+    '''
+    data = str(data)
+    header, sep, body = data.partition(":")
+    if not sep:
+        return _decode_legacy(data)
+    if int(header.rstrip("z")) != VERSION:
+        raise ValueError("Unknown notice queue payload version %r" % header)
+    body = body.decode("base64")
+    if header.endswith("z"):
+        body = zlib.decompress(body)
+    payload = pickle.loads(body)
+    kind, recipients = payload["recipients"]
+    if kind == "packed":
+        recipients = unpack_ids(recipients)
+    try:
+        sender = _resolve_sender(payload["sender"])
+    except ObjectDoesNotExist:
+        logger.warning("dropping queued %s notices: sender %r no longer exists"
+                       % (payload["label"], payload["sender"]))
+        return []
+    return [(payload["label"], payload["extra_context"], payload["on_site"],
+             sender, recipients, payload.get("media"), payload.get("throttled", True))]
@@ -0,0 +1,211 @@
+'''
+Two tier cache of the notice settings of each user, used by every send path
+(should_send, get_notification_settings) and the settings view.
+
+A user's complete {(notice_type_id, medium): send} matrix is stored in the
+app cache (see notification.caching) as one compact bitmap and, in front of
+it, in a small per process LRU with a short TTL so hot users cost no cache
+round trip. Writes go through invalidate(), other processes see them once
+their local entry expires.
+
+Every user has a generation, bumped by invalidate(). A matrix is cached with
+the generation read before it was loaded from the database and rejected
+when the generation moved since, so a load racing with a settings change
+can't cache the old settings.
+
+NOTIFICATION_USER_SETTINGS_TIMEOUT( = 86400) seconds a matrix is kept in the
+app cache.
+NOTIFICATION_PREFERENCE_LOCAL_SIZE( = 1000) number of users kept in the per
+process tier, 0 disables it.
+NOTIFICATION_PREFERENCE_LOCAL_TTL( = 5) seconds an entry of the per process
+tier is trusted, i.e. how long other nodes may send with outdated settings.
+'''
+# Python Core
+import time
+
+# Django
+from django.conf import settings
+
+# This app
+from notification import caching, payload
+
+USER_SETTINGS_TIMEOUT = getattr(settings, "NOTIFICATION_USER_SETTINGS_TIMEOUT", 86400)
+LOCAL_SIZE = getattr(settings, "NOTIFICATION_PREFERENCE_LOCAL_SIZE", 1000)
+LOCAL_TTL = getattr(settings, "NOTIFICATION_PREFERENCE_LOCAL_TTL", 5)
+
+
+local = caching.LocalCache(LOCAL_SIZE, LOCAL_TTL)
+
+_stats = {"local_hits": 0, "hits": 0, "misses": 0}
+
+
+def stats():
+    '''
+    Returns the hit and miss counters of this process: local_hits (per
+    process tier), hits (app cache), misses (loaded from the database),
+    local_size and hit_ratio.
+    '''
+    result = dict(_stats)
+    lookups = sum(_stats.values())
+    result["local_size"] = len(local)
+    result["hit_ratio"] = (result["local_hits"] + result["hits"]) / float(lookups) if lookups else 0.0
+    return result
+
+
+def reset_stats():
+    for key in _stats:
+        _stats[key] = 0
+
+
+def cache_key(user_id):
+    return "notification.preferences.%s" % user_id
+
+
+def generation_key(user_id):
+    return "notification.preferences.generation.%s" % user_id
+
+
+def get_generations(user_ids):
+    '''
+    Returns {user_id: generation}, starting the missing generations. Read it
+    before loading the settings that are passed to set_many.
+    '''
+    keys = dict((generation_key(user_id), user_id) for user_id in user_ids)
+    found = caching.cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # timestamps, so a generation evicted from the cache never comes back
+        # with a value an older matrix was stored with
+        now = int(time.time() * 1000)
+        for key in missing:
+            caching.cache.add(key, now, caching.GENERATION_TIMEOUT)
+        found.update(caching.cache.get_many(missing))
+    return dict((keys[key], generation) for key, generation in found.items())
+
+
+def get_current_generations(user_ids):
+    '''
+    Returns {user_id: generation} for the users whose generation is cached.
+    '''
+    keys = dict((generation_key(user_id), user_id) for user_id in user_ids)
+    return dict((keys[key], generation) for key, generation in
+                caching.cache.get_many(keys.keys()).items())
+
+
+# send values other than True/False, each stored as one more bitmask. The
+# models import them from here; append new ones, cached matrices are decoded
+# by position.
+HOURLY, DAILY = "hourly", "daily"
+DIGEST_FREQUENCIES = (HOURLY, DAILY)
+
+
+def encode(matrix):
+    '''
+    Packs a {(notice_type_id, medium): send} matrix as (media, notice type
+    ids packed with payload.pack_ids, known bits, send bits, one bitmask per
+    digest frequency). Bit i * len(media) + j is the setting of the i-th
+    notice type for the j-th medium.
+    '''
+    media = tuple(sorted(set(medium for notice_type_id, medium in matrix)))
+    ids = sorted(set(notice_type_id for notice_type_id, medium in matrix))
+    positions = dict((notice_type_id, i) for i, notice_type_id in enumerate(ids))
+    columns = dict((medium, j) for j, medium in enumerate(media))
+    known = sent = 0
+    frequencies = dict((frequency, 0) for frequency in DIGEST_FREQUENCIES)
+    for (notice_type_id, medium), send in matrix.items():
+        bit = 1 << (positions[notice_type_id] * len(media) + columns[medium])
+        known |= bit
+        if send:
+            sent |= bit
+        if send in frequencies:
+            frequencies[send] |= bit
+    return ((media, payload.pack_ids(ids), known, sent) +
+            tuple(frequencies[frequency] for frequency in DIGEST_FREQUENCIES))
+
+
+def decode(value):
+    '''
+    Reverse of encode.
+    '''
+    media, packed, known, sent = value[:4]
+    frequencies = zip(DIGEST_FREQUENCIES, value[4:])
+    matrix = {}
+    for i, notice_type_id in enumerate(payload.unpack_ids(packed)):
+        for j, medium in enumerate(media):
+            bit = 1 << (i * len(media) + j)
+            if known & bit:
+                send = bool(sent & bit)
+                for frequency, mask in frequencies:
+                    if mask & bit:
+                        send = frequency
+                matrix[(notice_type_id, medium)] = send
+    return matrix
+
+
+def get_many(user_ids):
+    '''
+    Returns {user_id: matrix} for the users found in either tier.
+    '''
+    found = {}
+    missing = []
+    for user_id in user_ids:
+        matrix = local.get(user_id)
+        if matrix is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = matrix
+    _stats["local_hits"] += len(found)
+    if missing:
+        keys = dict((cache_key(user_id), user_id) for user_id in missing)
+        generation_keys = dict((generation_key(user_id), user_id) for user_id in missing)
+        cached = caching.cache.get_many(keys.keys() + generation_keys.keys())
+        generations = dict((generation_keys[key], value) for key, value in cached.items()
+                           if key in generation_keys)
+        hits = 0
+        for key, user_id in keys.items():
+            value = cached.get(key)
+            # (generation, encoded matrix), anything else predates generations
+            if not isinstance(value, tuple) or len(value) != 2:
+                continue
+            generation, encoded = value
+            if generation is None or generation != generations.get(user_id):
+                # invalidated since it was loaded
+                continue
+            matrix = decode(encoded)
+            local.set(user_id, matrix)
+            found[user_id] = matrix
+            hits += 1
+        _stats["hits"] += hits
+        _stats["misses"] += len(missing) - hits
+    return found
+
+
+def set_many(matrices, generations):
+    '''
+    Stores {user_id: matrix} in both tiers, generations being the
+    get_generations() read before the matrices were loaded.
+    '''
+    caching.cache.set_many(dict((cache_key(user_id), (generations.get(user_id), encode(matrix)))
+                                for user_id, matrix in matrices.items()),
+                           USER_SETTINGS_TIMEOUT)
+    # users invalidated during the load are left out of the local tier, their
+    # app cache entry is rejected by get_many
+    current = get_current_generations(matrices.keys())
+    for user_id, matrix in matrices.items():
+        if current.get(user_id) == generations.get(user_id):
+            local.set(user_id, matrix)
+
+
+def invalidate(*user_ids):
+    '''
+    Drops the cached settings of the given users and bumps their generation
+    so loads already running can't cache them again. Other processes keep
+    their local copy for at most NOTIFICATION_PREFERENCE_LOCAL_TTL seconds.
+    '''
+    for user_id in user_ids:
+        local.delete(user_id)
+    for user_id in user_ids:
+        # a missing generation needs no bump, matrices stored with it are
+        # rejected already
+        caching.incr(generation_key(user_id))
+    caching.cache.delete_many([cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,195 @@
+'''
+Encoding of Notice.data, the extra_context saved with each website notice.
+
+Values are stored as compact JSON. Model instances are stored as
+{"$ref": [content_type_id, pk]} references instead of pickled objects and
+come back as ModelRef proxies that load the instance the first time they are
+used; resolve() loads the references of many values with one query per
+content type. Tuples, dates, times, datetimes and Decimals are tagged so they
+come back with their type, anything else JSON can't represent is pickled
+({"$pickle": "<base64>"}).
+'''
+# Python Core
+import datetime
+import decimal
+import json
+
+# Django
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from django.utils.functional import SimpleLazyObject, empty
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class ModelRef(SimpleLazyObject):
+    '''
+    Lazy proxy for a model instance stored as a reference. Behaves like the
+    instance (or None if it no longer exists) once loaded.
+    '''
+    def __init__(self, content_type_id, pk):
+        # set through __dict__, LazyObject forwards attributes to the instance
+        self.__dict__["_notification_ref"] = (content_type_id, pk)
+        super(ModelRef, self).__init__(lambda: _load(content_type_id, pk))
+
+
+def _load(content_type_id, pk):
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model is None:
+        return None
+    try:
+        return model._default_manager.get(pk=pk)
+    except ObjectDoesNotExist:
+        return None
+
+
+def _is_tag(value):
+    return len(value) == 1 and value.keys()[0].startswith("$")
+
+
+def _encode(value):
+    # checked first: any other isinstance check would load a proxied instance
+    if isinstance(value, ModelRef):
+        return {"$ref": list(reference_key(value))}
+    if value is None or isinstance(value, (bool, int, long, float, unicode)):
+        return value
+    if isinstance(value, str):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    elif isinstance(value, models.Model) and value.pk is not None:
+        content_type = ContentType.objects.get_for_model(value)
+        return {"$ref": [content_type.id, value.pk]}
+    elif isinstance(value, list):
+        return [_encode(item) for item in value]
+    elif isinstance(value, tuple):
+        return {"$tuple": [_encode(item) for item in value]}
+    elif isinstance(value, dict) and all(isinstance(key, basestring) for key in value):
+        encoded = dict((key, _encode(item)) for key, item in value.items())
+        if _is_tag(value):
+            return {"$dict": encoded}
+        return encoded
+    elif isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    elif isinstance(value, datetime.time):
+        return {"$time": value.isoformat()}
+    elif isinstance(value, decimal.Decimal):
+        return {"$decimal": str(value)}
+    return {"$pickle": pickle.dumps(value, pickle.HIGHEST_PROTOCOL).encode("base64")}
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if not _is_tag(value):
+        return dict((key, _decode(item)) for key, item in value.items())
+    tag, data = value.items()[0]
+    if tag == "$ref":
+        return ModelRef(*data)
+    if tag == "$tuple":
+        return tuple(_decode(item) for item in data)
+    if tag == "$dict":
+        return dict((key, _decode(item)) for key, item in data.items())
+    if tag == "$datetime":
+        return parse_datetime(data)
+    if tag == "$date":
+        return parse_date(data)
+    if tag == "$time":
+        return parse_time(data)
+    if tag == "$decimal":
+        return decimal.Decimal(data)
+    if tag == "$pickle":
+        return pickle.loads(str(data).decode("base64"))
+    raise ValueError("Unknown notice data tag %r" % tag)
+
+
+def dumps(value):
+    '''
+    Returns the JSON text representation of value.
+    '''
+    return json.dumps(_encode(value), separators=(",", ":"))
+
+
+def loads(text):
+    '''
+    Reverse of dumps. References are returned as (unloaded) ModelRef proxies.
+    '''
+    return _decode(json.loads(text))
+
+
+def references(value):
+    '''
+    Yields the ModelRef proxies of value that are not loaded yet.
+    '''
+    if isinstance(value, ModelRef):
+        if value._wrapped is empty:
+            yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for ref in references(item):
+                yield ref
+    elif isinstance(value, dict):
+        for item in value.values():
+            for ref in references(item):
+                yield ref
+
+
+def reference_key(ref):
+    '''
+    Returns the (content_type_id, pk) a ModelRef points to.
+    '''
+    return ref.__dict__["_notification_ref"]
+
+
+def set_reference(ref, obj):
+    '''
+    Loads ref with an instance fetched elsewhere (None if it does not exist).
+    '''
+    ref._wrapped = obj
+
+
+def resolve(values):
+    '''
+    Loads the references found in values with one query per content type.
+    '''
+    refs = [ref for value in values for ref in references(value)]
+    pks = {}
+    for ref in refs:
+        content_type_id, pk = reference_key(ref)
+        pks.setdefault(content_type_id, set()).add(pk)
+    objects = {}
+    for content_type_id, ids in pks.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            objects[content_type_id] = model._default_manager.in_bulk(list(ids))
+    for ref in refs:
+        content_type_id, pk = reference_key(ref)
+        set_reference(ref, objects.get(content_type_id, {}).get(pk))
+
+
+def unwrap(value):
+    '''
+    Returns a copy of value with the ModelRef proxies replaced by the
+    instances they point to. Call resolve() first to load them in bulk.
+    '''
+    if isinstance(value, ModelRef):
+        if value._wrapped is empty:
+            value._setup()
+        return value._wrapped
+    if isinstance(value, list):
+        return [unwrap(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(unwrap(item) for item in value)
+    if isinstance(value, dict):
+        return dict((key, unwrap(item)) for key, item in value.items())
+    return value
@@ -1,7 +1,9 @@
 from django.template import Library
 from django.conf import settings
 from django.contrib.auth.models import User
-from notification.models import NoticeType, get_notification_setting, NOTICE_MEDIA, NoticeSetting
+from notification.models import (NoticeType, NOTICE_MEDIA, NoticeSetting,
+                                 get_notice_types, get_user_notice_settings,
+                                 DIGEST_FREQUENCIES)
 
 register = Library()
 
@@ -14,16 +16,22 @@ def notification_settings(context):
     user_settings = []
     # Get list of user's settings
     if user.is_authenticated():
-        notice_types = NoticeType.objects.all()
+        notice_types = sorted(get_notice_types().values(), key=lambda nt: nt.id)
+        matrix = get_user_notice_settings(user)
         for notice in notice_types:
             for media in NOTICE_MEDIA:
-                setting = get_notification_setting(user, notice, media[0])
-                #setting.send = 'yes' if setting.send else ''
+                medium = str(media[0])
+                send = matrix[(notice.id, medium)]
+                # unsaved settings built from the cached matrix
+                setting = NoticeSetting(user=user, notice_type=notice, medium=medium,
+                                        send=bool(send))
+                if send in DIGEST_FREQUENCIES:
+                    setting.frequency = send
                 user_settings.append(setting)
 
     # Get list of available settings
     else:
-        notice_types = NoticeType.objects.all()
+        notice_types = sorted(get_notice_types().values(), key=lambda nt: nt.id)
         for notice in notice_types:
             for media in NOTICE_MEDIA:
                 setting = NoticeSetting(user=User(), notice_type=notice, medium=media[0])
@@ -0,0 +1,12 @@
+from notification.tests.mail import BulkMailerTest
+from notification.tests.indexes import InboxIndexTest
+from notification.tests.preferences import PreferenceCacheTest
+from notification.tests.payload import PayloadTest
+from notification.tests.serialization import NoticeDataTest, SerializationTest
+from notification.tests.website import UnseenCountTest, WebsiteDeliveryTest
+from notification.tests.delivery import DeliveryTest
+from notification.tests.throttle import ThrottleTest
+from notification.tests.unsubscribe import UnsubscribeTest
+from notification.tests.pagination import NoticePaginationTest
+from notification.tests.actions import BulkActionTest
+from notification.tests.executor import ExecutorTest
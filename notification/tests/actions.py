@@ -0,0 +1,115 @@
+import json
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from notification.backends.website import Notice
+from notification.models import NoticeType
+
+REFERER = "http://testserver/notices/"
+
+
+class BulkActionTest(TestCase):
+    urls = "notification.urls"
+
+    def setUp(self):
+        self.user = User.objects.create_user("reader", "reader@example.com", "secret")
+        self.other = User.objects.create_user("other", "other@example.com", "secret")
+        self.notice_type = NoticeType.objects.create(label="comment", display="Comment",
+                                                     description="a comment", default=2)
+        self.client.login(username="reader", password="secret")
+
+    def create(self, recipient=None, **kwargs):
+        recipient = recipient or self.user
+        return Notice.objects.create(recipient=recipient, notice_type=self.notice_type,
+                                     content_type=ContentType.objects.get_for_model(User),
+                                     object_id=recipient.pk, data={}, **kwargs)
+
+    def state(self, notice):
+        try:
+            notice = Notice.objects.get(pk=notice.pk)
+        except Notice.DoesNotExist:
+            return None
+        return notice.unseen, notice.archived
+
+    def post(self, url, data, ajax=True):
+        extra = {"HTTP_REFERER": REFERER}
+        if ajax:
+            extra["HTTP_X_REQUESTED_WITH"] = "XMLHttpRequest"
+        return self.client.post(url, data, **extra)
+
+    def toggle_all(self, data, ajax=True):
+        return self.post(reverse("notification_toggle_all"), data, ajax)
+
+    def test_toggle_all(self):
+        seen, archived, deleted, untouched = [self.create() for i in range(4)]
+        unseen = self.create(unseen=False)
+        response = self.toggle_all({
+            "%s-unseen" % seen.pk: "False",
+            "%s-archived" % archived.pk: "True",
+            "%s-unseen" % unseen.pk: "True",
+            "%s-delete" % deleted.pk: "True",
+            # deleted anyway
+            "%s-unseen" % deleted.pk: "False",
+            "%s-delete" % untouched.pk: "False",
+            "%s-bogus" % untouched.pk: "True",
+            "not-a-notice": "True",
+        })
+        self.assertEqual(json.loads(response.content), {
+            "unseen_False": 1, "archived_True": 1, "unseen_True": 1, "deleted": 1})
+        self.assertEqual(self.state(seen), (False, False))
+        self.assertEqual(self.state(archived), (True, True))
+        self.assertEqual(self.state(unseen), (True, False))
+        self.assertEqual(self.state(deleted), None)
+        self.assertEqual(self.state(untouched), (True, False))
+
+    def test_toggle_all_same_action_many_notices(self):
+        notices = [self.create() for i in range(5)]
+        data = dict(("%s-archived" % notice.pk, "True") for notice in notices[:4])
+        response = self.toggle_all(data)
+        self.assertEqual(json.loads(response.content), {"archived_True": 4})
+        self.assertEqual([self.state(notice)[1] for notice in notices],
+                         [True, True, True, True, False])
+
+    def test_toggle_all_other_users_notices(self):
+        notice = self.create(recipient=self.other)
+        data = {"%s-archived" % notice.pk: "True"}
+        response = self.toggle_all(data)
+        self.assertEqual(json.loads(response.content), {"archived_True": 0})
+        self.assertEqual(self.state(notice), (True, False))
+        # superusers can change any notice
+        User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        response = self.toggle_all(data)
+        self.assertEqual(json.loads(response.content), {"archived_True": 1})
+        self.assertEqual(self.state(notice), (True, True))
+
+    def test_toggle_all_redirects(self):
+        notice = self.create()
+        response = self.toggle_all({"%s-unseen" % notice.pk: "False"}, ajax=False)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], REFERER)
+        self.assertEqual(self.state(notice), (False, False))
+
+    def test_mark_all_seen(self):
+        notices = [self.create() for i in range(3)]
+        seen = self.create(unseen=False)
+        archived = self.create(archived=True)
+        other = self.create(recipient=self.other)
+        response = self.post(reverse("notification_mark_all_seen"), {})
+        self.assertEqual(json.loads(response.content), {"seen": 3})
+        for notice in notices + [seen]:
+            self.assertEqual(self.state(notice), (False, False))
+        # archived notices are not in the inbox
+        self.assertEqual(self.state(archived), (True, True))
+        self.assertEqual(self.state(other), (True, False))
+        response = self.post(reverse("notification_mark_all_seen"), {})
+        self.assertEqual(json.loads(response.content), {"seen": 0})
+
+    def test_mark_all_seen_redirects(self):
+        notice = self.create()
+        response = self.post(reverse("notification_mark_all_seen"), {}, ajax=False)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], REFERER)
+        self.assertEqual(self.state(notice), (False, False))
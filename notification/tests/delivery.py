@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.test import TestCase
+
+from notification import delivery
+from notification.models import NoticeType
+
+RECIPIENTS = ["a", "b", "c", "d", "e", "f"]
+
+
+class SlowBackend(object):
+    '''
+    Fake backend taking delay seconds per chunk. Records the chunks it got and
+    the most chunks it delivered at once. Waits for gate before the first
+    chunk when given one (gate_opened tells whether it opened in time),
+    raises in every chunk when fail.
+    '''
+    def __init__(self, delay=0.01, concurrent=False, gate=None, fail=False):
+        self.delay = delay
+        self.concurrent = concurrent
+        self.gate = gate
+        self.gate_opened = None
+        self.fail = fail
+        self.chunks = []
+        self.active = self.max_active = 0
+        self.started = threading.Event()
+        self._lock = threading.Lock()
+
+    def deliver_many(self, recipients, sender, notice_type, shared_context, per_user_context):
+        with self._lock:
+            self.chunks.append(list(recipients))
+            self.active += 1
+            self.max_active = max(self.active, self.max_active)
+        self.started.set()
+        try:
+            if self.gate is not None and len(self.chunks) == 1:
+                self.gate_opened = self.gate.wait(5)
+            time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("%s is down" % recipients)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class DeliveryTest(TestCase):
+
+    def setUp(self):
+        self.notice_type = NoticeType(label="comment")
+        limits = delivery.LIMITS
+        delivery.LIMITS = {}
+        self.addCleanup(setattr, delivery, "LIMITS", limits)
+
+    def deliver(self, *deliveries):
+        return delivery.deliver(deliveries, None, self.notice_type, {}, {})
+
+    def delivered(self, backend):
+        return sorted(r for chunk in backend.chunks for r in chunk)
+
+    def test_concurrency_limits(self):
+        delivery.LIMITS = {"email": {"concurrency": 2, "chunk_size": 1},
+                           "sms": {"chunk_size": 1}}
+        email = SlowBackend(concurrent=True)
+        sms = SlowBackend()
+        stats = self.deliver(("email", email, RECIPIENTS), ("sms", sms, RECIPIENTS))
+        self.assertEqual(stats["email"], {"delivered": 6, "failed": 0, "timed_out": 0})
+        self.assertEqual(stats["sms"], {"delivered": 6, "failed": 0, "timed_out": 0})
+        self.assertEqual(len(email.chunks), 6)
+        self.assertTrue(email.max_active <= 2)
+        # not declared concurrent: one chunk at a time
+        self.assertEqual(sms.max_active, 1)
+        self.assertEqual(self.delivered(sms), RECIPIENTS)
+
+    def test_backends_run_alongside(self):
+        sms = SlowBackend()
+        email = SlowBackend(gate=sms.started)
+        stats = self.deliver(("email", email, RECIPIENTS), ("sms", sms, RECIPIENTS))
+        # email only went on once sms had started
+        self.assertTrue(email.gate_opened)
+        self.assertEqual(stats["email"]["delivered"], 6)
+        self.assertEqual(stats["sms"]["delivered"], 6)
+
+    def test_deadline_drops_chunks_not_started(self):
+        delivery.LIMITS = {"email": {"timeout": 0.1, "chunk_size": 2}}
+        gate = threading.Event()
+        email = SlowBackend(gate=gate)
+        started = time.time()
+        stats = self.deliver(("email", email, RECIPIENTS))
+        # send_now does not wait for the chunk still being delivered
+        self.assertTrue(time.time() - started < 2)
+        self.assertEqual(stats["email"], {"delivered": 0, "failed": 0, "timed_out": 0})
+        gate.set()
+        delivery.pool.join()
+        self.assertEqual(email.chunks, [["a", "b"]])
+
+    def test_run_deadline(self):
+        run = delivery.BackendRun("email", SlowBackend(), RECIPIENTS, 4, 60)
+        self.assertEqual(run.next_chunk(), ["a", "b", "c", "d"])
+        run.deadline = time.time() - 1
+        self.assertEqual(run.next_chunk(), None)
+        self.assertEqual(run.stats, {"delivered": 0, "failed": 0, "timed_out": 2})
+
+    def test_failing_backend_does_not_stop_the_others(self):
+        delivery.LIMITS = {"email": {"chunk_size": 4}}
+        email = SlowBackend(fail=True)
+        website = SlowBackend()
+        stats = self.deliver(("email", email, RECIPIENTS), ("website", website, RECIPIENTS))
+        self.assertEqual(stats["email"], {"delivered": 0, "failed": 6, "timed_out": 0})
+        # the failure of a chunk does not stop the next one
+        self.assertEqual(self.delivered(email), RECIPIENTS)
+        self.assertEqual(stats["website"], {"delivered": 6, "failed": 0, "timed_out": 0})
+        self.assertEqual(self.delivered(website), RECIPIENTS)
+
+    def test_no_recipients(self):
+        self.assertEqual(self.deliver(("email", SlowBackend(), [])), {})
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from django.test import TestCase
+
+from notification.executor import DeliveryExecutor, DeliveryQueueFull
+
+
+def fail():
+    raise RuntimeError("smtp server is down")
+
+
+class ExecutorTest(TestCase):
+
+    def executor(self, **kwargs):
+        executor = DeliveryExecutor(**kwargs)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def test_handle(self):
+        executor = self.executor(workers=2)
+        handle = executor.submit(lambda a, b=0: a + b, 40, b=2)
+        self.assertEqual(handle.get(5), 42)
+        self.assertTrue(handle.done())
+
+    def test_handle_exception(self):
+        handle = self.executor().submit(fail)
+        self.assertTrue(handle.wait(5))
+        self.assertRaises(RuntimeError, handle.get)
+
+    def test_join(self):
+        executor = self.executor(workers=2)
+        done = []
+
+        def deliver(i):
+            time.sleep(0.01)
+            done.append(i)
+
+        handles = [executor.submit(deliver, i) for i in range(6)]
+        executor.join()
+        self.assertEqual(sorted(done), range(6))
+        self.assertTrue(all(handle.done() for handle in handles))
+
+    def test_shutdown_delivers_what_is_queued(self):
+        executor = DeliveryExecutor(workers=1)
+        done = []
+        for i in range(3):
+            executor.submit(done.append, i)
+        executor.shutdown()
+        self.assertEqual(done, [0, 1, 2])
+
+    def test_queue_full(self):
+        executor = self.executor(workers=1, queue_size=1)
+        started = threading.Event()
+        gate = threading.Event()
+
+        def blocked():
+            started.set()
+            gate.wait(5)
+
+        executor.submit(blocked)
+        self.assertTrue(started.wait(5))
+        executor.submit(lambda: None)
+        self.assertRaises(DeliveryQueueFull, executor.submit, lambda: None, block=False)
+        gate.set()
+        executor.join()
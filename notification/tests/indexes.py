@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+
+from notification import models as notification
+
+NOTICE_TABLE = "notification_notice"
+
+# columns of the composite indexes created by migration 0007
+INBOX = ["recipient_id", "archived", "added"]
+UNSEEN = ["recipient_id", "archived", "unseen"]
+SENDER = ["content_type_id", "object_id", "recipient_id"]
+
+
+def index_name(columns):
+    from south.db import db
+    return db.create_index_name(NOTICE_TABLE, columns)
+
+
+def explain(queryset):
+    '''
+    Returns the query plan of queryset as text.
+    '''
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    cursor = connection.cursor()
+    if connection.vendor == "sqlite":
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return "\n".join(row[-1] for row in cursor.fetchall())
+    # on tables this small postgres would rather scan, ask for the plan it
+    # uses once they are not
+    cursor.execute("SET enable_seqscan = off")
+    try:
+        cursor.execute("EXPLAIN " + sql, params)
+        return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.execute("SET enable_seqscan = on")
+
+
+class InboxIndexTest(TestCase):
+    '''
+    Checks with EXPLAIN that the inbox, unseen count, mark_read and
+    prune_notices queries are served by the indexes of migration 0007 (or
+    the primary key) instead of scanning the notice table.
+    '''
+
+    def setUp(self):
+        if notification.website is None:
+            self.skipTest("the website backend is not installed")
+        if ("south" not in settings.INSTALLED_APPS or
+                not getattr(settings, "SOUTH_TESTS_MIGRATE", True)):
+            self.skipTest("the test database is not created by the migrations")
+        if connection.vendor not in ("sqlite", "postgresql"):
+            self.skipTest("no query plan check for %s" % connection.vendor)
+        self.Notice = notification.Notice
+        self.user = User.objects.create_user("reader", "reader@example.com")
+
+    def assertUsesIndex(self, queryset, *names):
+        plan = explain(queryset)
+        self.assertTrue(any(name in plan for name in names),
+                        "expected one of %s in the plan:\n%s" % (", ".join(names), plan))
+
+    def test_inbox(self):
+        notices = self.Notice.objects.notices_for(self.user, archived=False)\
+                                     .order_by("-added", "-id")
+        self.assertUsesIndex(notices, index_name(INBOX))
+
+    def test_unseen_count(self):
+        unseen = self.Notice.objects.notices_for(self.user, unseen=True).values("id")
+        self.assertUsesIndex(unseen, index_name(UNSEEN),
+                             "notification_notice_unseen_partial")
+
+    def test_mark_read(self):
+        content_type = ContentType.objects.get_for_model(User)
+        notices = self.Notice.objects.filter(content_type=content_type,
+                                             object_id=self.user.pk,
+                                             recipient=self.user, unseen=True)
+        self.assertUsesIndex(notices, index_name(SENDER))
+
+    def test_prune_per_user(self):
+        # prune_notices --max-per-user
+        notices = self.Notice.objects.filter(recipient=self.user)\
+                                     .order_by("-added", "-id").values("id")
+        self.assertUsesIndex(notices, index_name(INBOX), index_name(UNSEEN),
+                             index_name(["recipient_id"]))
+
+    def test_prune_range(self):
+        # prune_notices --archived-older-than and --max-age walk id ranges
+        notices = self.Notice.objects.filter(archived=True, id__gte=1, id__lt=1001)
+        self.assertUsesIndex(notices, "PRIMARY KEY", "_pkey")
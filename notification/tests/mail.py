@@ -0,0 +1,122 @@
+import smtplib
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends import locmem
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from notification.backends.email import BulkMailer
+
+REFUSED = "refused@example.com"
+DISCONNECT = "disconnect@example.com"
+
+
+class FakeSMTPBackend(locmem.EmailBackend):
+    '''
+    locmem backend failing like an SMTP server: messages to REFUSED raise
+    SMTPRecipientsRefused, messages to DISCONNECT drop the connection and
+    the connections numbered in fail_opens (1 being the first) can't be
+    opened. Counts the connections opened and closed.
+    '''
+    opened = 0
+    closed = 0
+    fail_opens = ()
+
+    def open(self):
+        FakeSMTPBackend.opened += 1
+        if FakeSMTPBackend.opened in FakeSMTPBackend.fail_opens:
+            raise smtplib.SMTPConnectError(421, "Service not available")
+        return True
+
+    def close(self):
+        FakeSMTPBackend.closed += 1
+
+    def send_messages(self, messages):
+        for message in messages:
+            if REFUSED in message.to:
+                raise smtplib.SMTPRecipientsRefused({REFUSED: (550, "No such user")})
+            if DISCONNECT in message.to:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return super(FakeSMTPBackend, self).send_messages(messages)
+
+
+def message(to):
+    return EmailMessage("subject", "body", "notices@example.com", [to])
+
+
+@override_settings(EMAIL_BACKEND="notification.tests.mail.FakeSMTPBackend")
+class BulkMailerTest(TestCase):
+
+    def setUp(self):
+        FakeSMTPBackend.opened = FakeSMTPBackend.closed = 0
+        FakeSMTPBackend.fail_opens = ()
+        mail.outbox = []
+
+    def send(self, recipients, **kwargs):
+        mailer = BulkMailer(**kwargs)
+        try:
+            mailer.send_messages([message(to) for to in recipients])
+        finally:
+            mailer.close()
+        return mailer
+
+    def test_refused_recipient_does_not_stop_the_batch(self):
+        mailer = self.send(["a@example.com", REFUSED, "b@example.com"])
+        self.assertEqual(len(mailer.failures), 1)
+        failed, e = mailer.failures[0]
+        self.assertEqual(failed.to, [REFUSED])
+        self.assertTrue(isinstance(e, smtplib.SMTPRecipientsRefused))
+        self.assertEqual([m.to for m in mail.outbox],
+                         [["a@example.com"], ["b@example.com"]])
+        self.assertEqual(mailer.sent, 2)
+        # a refused recipient keeps the connection
+        self.assertEqual(FakeSMTPBackend.opened, 1)
+
+    def test_reconnects_after(self):
+        mailer = self.send(["%s@example.com" % i for i in range(5)], reconnect_after=2)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mailer.failures, [])
+        self.assertEqual(FakeSMTPBackend.opened, 3)
+        self.assertEqual(FakeSMTPBackend.closed, 3)
+
+    def test_connection_error_reconnects(self):
+        mailer = self.send(["a@example.com", DISCONNECT, "b@example.com"])
+        self.assertEqual(len(mailer.failures), 1)
+        failed, e = mailer.failures[0]
+        self.assertEqual(failed.to, [DISCONNECT])
+        self.assertTrue(isinstance(e, smtplib.SMTPServerDisconnected))
+        # the broken connection is closed and a new one opened for the rest
+        self.assertEqual([m.to for m in mail.outbox],
+                         [["a@example.com"], ["b@example.com"]])
+        self.assertEqual(FakeSMTPBackend.opened, 2)
+        self.assertEqual(FakeSMTPBackend.closed, 2)
+
+    def test_connect_failure_fails_the_rest(self):
+        FakeSMTPBackend.fail_opens = (1,)
+        mailer = self.send(["a@example.com", "b@example.com"])
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual([m.to for m, e in mailer.failures],
+                         [["a@example.com"], ["b@example.com"]])
+        self.assertTrue(all(isinstance(e, smtplib.SMTPConnectError)
+                            for m, e in mailer.failures))
+
+    def test_reconnect_failure_fails_the_rest(self):
+        FakeSMTPBackend.fail_opens = (2,)
+        mailer = self.send(["%s@example.com" % i for i in range(4)], reconnect_after=2)
+        self.assertEqual([m.to for m in mail.outbox],
+                         [["0@example.com"], ["1@example.com"]])
+        self.assertEqual([m.to for m, e in mailer.failures],
+                         [["2@example.com"], ["3@example.com"]])
+        self.assertEqual(mailer.sent, 2)
+
+    def test_next_batch_connects_again(self):
+        FakeSMTPBackend.fail_opens = (1,)
+        mailer = BulkMailer()
+        try:
+            mailer.send_messages([message("a@example.com")])
+            mailer.send_messages([message("b@example.com")])
+        finally:
+            mailer.close()
+        self.assertEqual([m.to for m, e in mailer.failures], [["a@example.com"]])
+        self.assertEqual([m.to for m in mail.outbox], [["b@example.com"]])
@@ -0,0 +1,133 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test import TestCase
+from django.utils import timezone
+
+from notification import views
+from notification.backends.website import Notice
+from notification.models import NoticeType
+
+
+class NoticePaginationTest(TestCase):
+    urls = "notification.urls"
+
+    def setUp(self):
+        self.user = User.objects.create_user("reader", "reader@example.com", "secret")
+        self.client.login(username="reader", password="secret")
+        self.notice_type = NoticeType.objects.create(label="comment", display="Comment",
+                                                     description="a comment", default=2)
+
+    def create(self, n, **kwargs):
+        '''
+        Creates n notices of the user, returns their queryset.
+        '''
+        content_type = ContentType.objects.get_for_model(User)
+        Notice.objects.bulk_create([Notice(recipient=self.user, notice_type=self.notice_type,
+                                           content_type=content_type, object_id=self.user.pk,
+                                           data={}, **kwargs)
+                                    for i in range(n)])
+        return Notice.objects.filter(recipient=self.user).order_by("-id")[:n]
+
+    def pages(self, notices, cursor=None, page_size=3):
+        pages = []
+        while True:
+            page, cursor = views.paginate_notices(notices, cursor, page_size)
+            pages.append([notice.id for notice in page])
+            if cursor is None:
+                return pages
+
+    def test_equal_timestamps(self):
+        self.create(7)
+        Notice.objects.update(added=timezone.now())
+        ids = list(Notice.objects.order_by("-id").values_list("id", flat=True))
+        pages = self.pages(Notice.objects.all())
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), ids)
+
+    def test_cursor(self):
+        self.create(3)
+        notice = Notice.objects.order_by("-id")[1]
+        self.assertEqual(views.decode_cursor(views.encode_cursor(notice)),
+                         (notice.added, notice.id))
+
+    def test_bad_cursors(self):
+        self.create(4)
+        first = self.pages(Notice.objects.all())[0]
+        for cursor in ("", "junk", "1234567-x", "1-2-3", "-1234567-1",
+                       "9" * 30 + "-1"):
+            self.assertEqual(self.pages(Notice.objects.all(), cursor)[0], first,
+                             "cursor %r" % cursor)
+
+    def test_out_of_range_cursors(self):
+        self.create(4)
+        # before 1970: nothing
+        self.assertEqual(self.pages(Notice.objects.all(), "0000000-1"), [[]])
+        # far in the future: everything
+        self.assertEqual(len(sum(self.pages(Notice.objects.all(), "99999999999000000-1"), [])), 4)
+
+    def feed(self, **params):
+        '''
+        Returns the ids of every page of the feed, following next.
+        '''
+        params["render"] = "0"
+        ids = []
+        while True:
+            response = self.client.get(reverse("notification_notices_feed"), params)
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(response.content)
+            ids.extend(item["id"] for item in content["notices"])
+            if content["next"] is None:
+                return ids
+            params["before"] = content["next"]
+
+    def test_feed_filters_on_every_page(self):
+        size = views.PAGE_SIZE
+        unseen = set(notice.id for notice in self.create(size + 2))
+        seen = set(notice.id for notice in self.create(size + 1, unseen=False))
+        archived = set(notice.id for notice in self.create(2, archived=True))
+        Notice.objects.update(added=timezone.now())
+        for params, expected in (({}, unseen | seen), ({"unseen": "1"}, unseen),
+                                 ({"unseen": "0"}, seen), ({"archived": "1"}, archived)):
+            ids = self.feed(**params)
+            self.assertEqual(len(ids), len(expected))
+            self.assertEqual(set(ids), expected)
+
+    def test_feed_items(self):
+        notice = self.create(1)[0]
+        response = self.client.get(reverse("notification_notices_feed"),
+                                   {"render": "0", "before": "junk"})
+        content = json.loads(response.content)
+        self.assertEqual(content["next"], None)
+        self.assertEqual(content["notices"], [{
+            "id": notice.id, "added": notice.added.isoformat(), "unseen": True,
+            "archived": False, "notice_type": "comment", "display": "Comment",
+            "sender_type": ContentType.objects.get_for_model(User).name,
+            "object_id": self.user.pk,
+        }])
+
+    def test_recent_filter_on_every_page(self):
+        pages = []
+
+        def render_to_response(template, context, **kwargs):
+            pages.append(context)
+            return HttpResponse()
+
+        self.addCleanup(setattr, views, "render_to_response", views.render_to_response)
+        self.addCleanup(setattr, views, "render_many", views.render_many)
+        views.render_to_response = render_to_response
+        views.render_many = lambda notices: None
+        recent = set(notice.id for notice in self.create(views.PAGE_SIZE + 2))
+        self.create(3, unseen=False)
+        Notice.objects.exclude(pk__in=recent).update(added=timezone.now() - timedelta(days=10))
+
+        self.client.get(reverse("notification_notices"))
+        self.assertEqual(len(pages[0]["notices"]), views.PAGE_SIZE)
+        self.client.get(reverse("notification_notices"), {"before": pages[0]["next_cursor"]})
+        # the old seen notices are not shown on the second page either
+        self.assertEqual(set(notice.id for page in pages for notice in page["notices"]), recent)
+        self.assertEqual(pages[1]["next_cursor"], None)
@@ -0,0 +1,89 @@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from notification import payload
+
+
+def legacy(notices):
+    '''
+    Returns notices as written by queue() up to 0.2.
+    '''
+    return pickle.dumps(notices).encode("base64")
+
+
+class PayloadTest(TestCase):
+
+    def setUp(self):
+        self.sender = User.objects.create_user("sender", "sender@example.com")
+
+    def test_round_trip(self):
+        context = {"comment": u"caf\xe9", "count": 3}
+        for compress in (True, False):
+            data = payload.encode([3, 1, 2], "comment", context, False, None,
+                                  compress=compress, media=["email"], throttled=False)
+            self.assertTrue(data.startswith(compress and "2z:" or "2:"))
+            self.assertEqual(payload.decode(data),
+                             [("comment", context, False, None, [1, 2, 3], ["email"], False)])
+
+    def test_defaults(self):
+        jobs = payload.decode(payload.encode([1], "comment", {}, True, None))
+        self.assertEqual(jobs, [("comment", {}, True, None, [1], None, True)])
+
+    def test_pack_ids(self):
+        for ids in ([], [0], [5, 1, 3], [7, 7, 2, 7, 2], [1, 127, 128, 2 ** 14, 2 ** 40]):
+            self.assertEqual(payload.unpack_ids(payload.pack_ids(ids)), sorted(set(ids)))
+        # deltas below 128 take one byte each
+        self.assertEqual(len(payload.pack_ids(range(1, 1001))), 1000)
+        # a large gap takes one byte per 7 bits of the delta
+        self.assertEqual(len(payload.pack_ids([1, 1 + 2 ** 21])), 1 + 4)
+
+    def test_unpacked_ids(self):
+        # keys that aren't non negative integers are stored as they are
+        for ids in ([-1, 2], ["a", "b"]):
+            jobs = payload.decode(payload.encode(ids, "comment", {}, True, None))
+            self.assertEqual(jobs[0][4], ids)
+
+    def test_sender_reference(self):
+        data = payload.encode([1], "comment", {}, True, self.sender, compress=False)
+        # the sender is stored as a reference, not pickled
+        self.assertFalse("sender@example.com" in data.partition(":")[2].decode("base64"))
+        sender = payload.decode(data)[0][3]
+        self.assertTrue(isinstance(sender, User))
+        self.assertEqual(sender.pk, self.sender.pk)
+
+    def test_deleted_sender(self):
+        data = payload.encode([1], "comment", {}, True, self.sender)
+        self.sender.delete()
+        self.assertEqual(payload.decode(data), [])
+
+    def test_unsaved_sender(self):
+        sender = User(username="unsaved")
+        jobs = payload.decode(payload.encode([1], "comment", {}, True, sender))
+        self.assertEqual(jobs[0][3].username, "unsaved")
+
+    def test_legacy(self):
+        context = {"comment": "hi"}
+        # one queue() call pickles a single context and sender for all users
+        notices = [(1, "comment", context, True, self.sender),
+                   (2, "comment", context, True, self.sender),
+                   (3, "reply", context, True, self.sender)]
+        jobs = payload.decode(legacy(notices))
+        self.assertEqual([(label, ctx, on_site, user_ids, media, throttled)
+                          for label, ctx, on_site, sender, user_ids, media, throttled in jobs],
+                         [("comment", context, True, [1, 2], None, True),
+                          ("reply", context, True, [3], None, True)])
+        self.assertEqual(jobs[0][3].pk, self.sender.pk)
+
+    def test_legacy_separate_calls(self):
+        # separately pickled contexts aren't merged even when equal
+        data = legacy([(1, "comment", {}, True, None)])
+        notices = pickle.loads(data.decode("base64")) + [(2, "comment", {}, True, None)]
+        self.assertEqual([job[4] for job in payload.decode(legacy(notices))], [[1], [2]])
+
+    def test_unknown_version(self):
+        self.assertRaises(ValueError, payload.decode, "3:" + "x".encode("base64"))
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.cache.backends.dummy import DummyCache
+from django.test import TestCase
+
+from notification import caching, preferences
+from notification.models import _get_user_notice_settings, MUTED, NOTICE_MEDIA
+
+MATRIX = {(1, "0"): True, (1, "1"): "daily", (2, "0"): False}
+
+
+class PreferenceCacheTest(TestCase):
+
+    def setUp(self):
+        if isinstance(caching.cache, DummyCache):
+            self.skipTest("NOTIFICATION_CACHE is a dummy cache")
+        self.user = User.objects.create_user("reader", "reader@example.com")
+        self.addCleanup(preferences.invalidate, self.user.pk)
+        preferences.invalidate(self.user.pk)
+
+    def test_encode_round_trip(self):
+        self.assertEqual(preferences.decode(preferences.encode(MATRIX)), MATRIX)
+
+    def test_set_many_then_get_many(self):
+        generations = preferences.get_generations([self.user.pk])
+        preferences.set_many({self.user.pk: MATRIX}, generations)
+        preferences.local.clear()
+        self.assertEqual(preferences.get_many([self.user.pk]), {self.user.pk: MATRIX})
+
+    def test_invalidate_during_load(self):
+        # load reads the generation, the settings change, the load finishes
+        generations = preferences.get_generations([self.user.pk])
+        preferences.invalidate(self.user.pk)
+        preferences.set_many({self.user.pk: MATRIX}, generations)
+        self.assertEqual(preferences.get_many([self.user.pk]), {})
+        preferences.local.clear()
+        self.assertEqual(preferences.get_many([self.user.pk]), {})
+
+    def test_invalidate_during_settings_load(self):
+        set_many = preferences.set_many
+
+        def set_many_after_unsubscribe(matrices, generations):
+            preferences.invalidate(self.user.pk)
+            set_many(matrices, generations)
+
+        medium = str(NOTICE_MEDIA[0][0])
+        preferences.set_many = set_many_after_unsubscribe
+        try:
+            matrix = _get_user_notice_settings([self.user.pk], [(MUTED, medium)])
+        finally:
+            preferences.set_many = set_many
+        # the load still returns what it read, but nothing stale is cached
+        self.assertFalse(matrix[self.user.pk][(MUTED, medium)])
+        self.assertEqual(preferences.get_many([self.user.pk]), {})
@@ -0,0 +1,163 @@
+import datetime
+import decimal
+import json
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.functional import empty
+from django.utils.importlib import import_module
+
+from notification import serialization
+from notification.backends.website import Notice
+from notification.models import NoticeType
+
+VALUES = {
+    "tuple": (1, u"two", [3]),
+    "datetime": datetime.datetime(2012, 5, 1, 12, 30, tzinfo=timezone.utc),
+    "date": datetime.date(2012, 5, 1),
+    "time": datetime.time(12, 30, 15),
+    "decimal": decimal.Decimal("9.99"),
+    "set": set([1, 2]),
+    "tag": {"$tuple": [1]},
+    "nested": [{"a": None, "b": True, "c": 1.5}],
+}
+
+
+def raw_data(notice_id):
+    cursor = connection.cursor()
+    cursor.execute("SELECT data FROM notification_notice WHERE id = %s", [notice_id])
+    return cursor.fetchone()[0]
+
+
+def set_raw_data(notice_id, data):
+    cursor = connection.cursor()
+    cursor.execute("UPDATE notification_notice SET data = %s WHERE id = %s", [data, notice_id])
+
+
+class SerializationTest(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user("user%s" % i, "user%s@example.com" % i)
+                      for i in range(3)]
+        self.content_type = ContentType.objects.get_for_model(User)
+
+    def test_round_trip(self):
+        self.assertEqual(serialization.loads(serialization.dumps(VALUES)), VALUES)
+
+    def test_tags(self):
+        encoded = json.loads(serialization.dumps(VALUES))
+        self.assertEqual(encoded["tuple"], {"$tuple": [1, "two", [3]]})
+        self.assertEqual(encoded["datetime"], {"$datetime": "2012-05-01T12:30:00+00:00"})
+        self.assertEqual(encoded["decimal"], {"$decimal": "9.99"})
+        self.assertEqual(encoded["set"].keys(), ["$pickle"])
+        # a dict looking like a tag is escaped
+        self.assertEqual(encoded["tag"], {"$dict": {"$tuple": [1]}})
+        self.assertEqual(encoded["nested"], VALUES["nested"])
+
+    def test_str(self):
+        self.assertEqual(serialization.loads(serialization.dumps("caf\xc3\xa9")), u"caf\xe9")
+        # not utf-8: pickled as it is
+        self.assertEqual(serialization.loads(serialization.dumps("\xff")), "\xff")
+
+    def test_unknown_tag(self):
+        self.assertRaises(ValueError, serialization.loads, '{"$nope":1}')
+
+    def test_reference(self):
+        user = self.users[0]
+        text = serialization.dumps({"user": user})
+        self.assertEqual(json.loads(text), {"user": {"$ref": [self.content_type.id, user.pk]}})
+        ref = serialization.loads(text)["user"]
+        self.assertTrue(isinstance(ref, serialization.ModelRef))
+        self.assertTrue(ref._wrapped is empty)
+        with self.assertNumQueries(1):
+            self.assertEqual(ref.username, user.username)
+            self.assertEqual(ref.pk, user.pk)
+
+    def test_dump_reference_without_loading(self):
+        text = serialization.dumps([self.users[0]])
+        ref = serialization.loads(text)[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(serialization.dumps([ref]), text)
+        self.assertTrue(ref._wrapped is empty)
+
+    def test_resolve(self):
+        values = [serialization.loads(serialization.dumps({"user": user, "users": (user,)}))
+                  for user in self.users]
+        with self.assertNumQueries(1):
+            serialization.resolve(values)
+        self.assertEqual(list(serialization.references(values)), [])
+        values = serialization.unwrap(values)
+        self.assertEqual([value["user"].pk for value in values],
+                         [user.pk for user in self.users])
+        self.assertEqual(type(values[0]["users"][0]), User)
+
+    def test_deleted_reference(self):
+        text = serialization.dumps([self.users[0], self.users[1]])
+        self.users[0].delete()
+        refs = serialization.loads(text)
+        self.assertEqual(serialization.unwrap(refs[0]), None)
+        serialization.resolve([refs[1:]])
+        self.assertEqual(serialization.unwrap(refs[1]).pk, self.users[1].pk)
+        refs = serialization.loads(text)
+        serialization.resolve([refs])
+        self.assertEqual(serialization.unwrap(refs)[0], None)
+
+
+class NoticeDataTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("reader", "reader@example.com")
+        notice_type = NoticeType.objects.create(label="comment", display="Comment",
+                                                description="a comment", default=2)
+        self.notice = Notice.objects.create(recipient=self.user, notice_type=notice_type,
+                                            content_type=ContentType.objects.get_for_model(User),
+                                            object_id=self.user.pk,
+                                            data={"sender": self.user, "count": 2})
+
+    def test_stored_as_json(self):
+        self.assertTrue(raw_data(self.notice.pk).startswith("{"))
+        data = Notice.objects.get(pk=self.notice.pk).data
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["sender"].pk, self.user.pk)
+
+    def test_legacy_pickled_row(self):
+        from picklefield.fields import dbsafe_encode
+        set_raw_data(self.notice.pk, dbsafe_encode({"sender": self.user, "count": 2}))
+        data = Notice.objects.get(pk=self.notice.pk).data
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["sender"].pk, self.user.pk)
+
+    def create_notice(self):
+        return Notice.objects.create(recipient=self.user, notice_type=self.notice.notice_type,
+                                     content_type=self.notice.content_type,
+                                     object_id=self.user.pk, data={})
+
+    def test_migration(self):
+        try:
+            migration = import_module("notification.migrations.0008_notice_data_json").Migration()
+        except ImportError:
+            self.skipTest("south is not installed")
+        from picklefield.fields import dbsafe_decode, dbsafe_encode
+        orm = {"notification.Notice": Notice}
+        # one notice per id range, one of the ranges empty
+        migration.batch_size = 1
+        self.create_notice().delete()
+        legacy = self.create_notice()
+        set_raw_data(legacy.pk, dbsafe_encode({"sender": self.user, "when": (1, 2)}))
+        json_data = raw_data(self.notice.pk)
+
+        migration.forwards(orm)
+        self.assertEqual(raw_data(self.notice.pk), json_data)
+        data = serialization.loads(raw_data(legacy.pk))
+        self.assertEqual(data["when"], (1, 2))
+        self.assertEqual(serialization.reference_key(data["sender"]),
+                         (self.notice.content_type.id, self.user.pk))
+
+        migration.backwards(orm)
+        for notice_id in (self.notice.pk, legacy.pk):
+            data = dbsafe_decode(raw_data(notice_id))
+            self.assertEqual(type(data["sender"]), User)
+            self.assertEqual(data["sender"].pk, self.user.pk)
@@ -0,0 +1,159 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache.backends.dummy import DummyCache
+from django.test import TestCase
+from django.utils import timezone
+
+from notification import caching, payload, throttle
+from notification import models as notification
+from notification.engine import LOCK_EXPIRE
+
+
+class ThrottleTest(TestCase):
+
+    def setUp(self):
+        self.sender = User.objects.create_user("sender", "sender@example.com")
+        self.users = [User.objects.create_user("user%s" % i, "user%s@example.com" % i)
+                      for i in range(3)]
+        self.notice_type = notification.NoticeType.objects.create(
+            label="comment", display="Comment", description="a comment", default=2)
+        config = throttle.THROTTLE
+        self.addCleanup(setattr, throttle, "THROTTLE", config)
+        self.clear_counters()
+        self.addCleanup(self.clear_counters)
+
+    def clear_counters(self):
+        content_type = ContentType.objects.get_for_model(User)
+        caching.cache.delete_many([
+            throttle.throttle_key(label, user.pk, self.notice_type.pk, content_type.pk,
+                                  self.sender.pk)
+            for label in ("email", "website") for user in self.users])
+        throttle.local.clear()
+
+    def apply(self, label, users=None):
+        return throttle.apply(label, users or self.users, self.notice_type, self.sender,
+                              {"comment": "hi"})
+
+    def test_not_throttled(self):
+        throttle.THROTTLE = {"email": {"window": 60}}
+        for i in range(3):
+            self.assertEqual(self.apply("website"), self.users)
+        self.assertEqual(throttle.apply("email", self.users, self.notice_type, None, {}),
+                         self.users)
+
+    def test_drop(self):
+        throttle.THROTTLE = {"email": {"window": 60, "limit": 2}}
+        self.assertEqual(self.apply("email", self.users[:1]), self.users[:1])
+        self.assertEqual(self.apply("email"), self.users)
+        self.assertEqual(self.apply("email"), self.users[1:])
+        self.assertEqual(self.apply("email"), [])
+        self.assertEqual(notification.NoticeQueueBatch.objects.count(), 0)
+        # every backend is counted on its own
+        throttle.THROTTLE["website"] = {"window": 60}
+        self.assertEqual(self.apply("website"), self.users)
+
+    def test_collapse(self):
+        if notification.website is None:
+            self.skipTest("the website backend is not installed")
+        Notice = notification.Notice
+        throttle.THROTTLE = {"website": {"window": 60, "policy": throttle.COLLAPSE}}
+        self.assertEqual(self.apply("website"), self.users)
+        notices = notification.website.deliver_many(self.users, self.sender,
+                                                    self.notice_type, {})
+        Notice.objects.update(unseen=False)
+        self.assertEqual(self.apply("website"), [])
+        self.assertEqual(self.apply("website"), [])
+        for notice in Notice.objects.filter(pk__in=[n.pk for n in notices.values()]):
+            self.assertEqual(notice.occurrences, 3)
+            self.assertTrue(notice.unseen)
+        self.assertEqual(Notice.objects.count(), len(self.users))
+
+    def test_collapse_drops_other_backends(self):
+        throttle.THROTTLE = {"email": {"window": 60, "policy": throttle.COLLAPSE}}
+        self.apply("email")
+        self.assertEqual(self.apply("email"), [])
+        self.assertEqual(notification.NoticeQueueBatch.objects.count(), 0)
+
+    def test_delay(self):
+        throttle.THROTTLE = {"email": {"window": 60, "policy": throttle.DELAY}}
+        self.assertEqual(self.apply("email", self.users[:1]), self.users[:1])
+        before = timezone.now()
+        self.assertEqual(self.apply("email"), self.users[1:])
+        batch = notification.NoticeQueueBatch.objects.get()
+        self.assertEqual(batch.locked_by, "delayed")
+        self.assertTrue(batch.locked_at >= before + timedelta(seconds=60 - LOCK_EXPIRE))
+        # sent through the throttled backend only, without being counted again
+        self.assertEqual(payload.decode(batch.pickled_data),
+                         [("comment", {"comment": "hi"}, True, self.sender,
+                           [self.users[0].pk], ["email"], False)])
+
+    def test_count(self):
+        if isinstance(caching.cache, DummyCache):
+            self.skipTest("NOTIFICATION_CACHE is a dummy cache")
+        key = "notification.tests.throttle"
+        self.addCleanup(caching.cache.delete, key)
+        caching.cache.delete(key)
+        self.assertEqual(throttle.count([key], 60), {key: 1})
+        self.assertEqual(throttle.count([key], 60), {key: 2})
+        self.assertEqual(caching.cache.get(key), 2)
+
+    def test_concurrent_count(self):
+        if isinstance(caching.cache, DummyCache):
+            self.skipTest("NOTIFICATION_CACHE is a dummy cache")
+        key = "notification.tests.throttle"
+        self.addCleanup(caching.cache.delete, key)
+        self.addCleanup(delattr, caching.cache, "add")
+        caching.cache.delete(key)
+        add = caching.cache.add
+        other = []
+
+        def add_after_other_send(*args, **kwargs):
+            # another process counts the same notice first
+            if not other:
+                other.append(None)
+                other.append(throttle.count([key], 60)[key])
+            return add(*args, **kwargs)
+
+        caching.cache.add = add_after_other_send
+        counts = throttle.count([key], 60)
+        # only one of them starts the window
+        self.assertEqual((other[1], counts[key]), (1, 2))
+
+    def test_count_expired_between_add_and_incr(self):
+        if isinstance(caching.cache, DummyCache):
+            self.skipTest("NOTIFICATION_CACHE is a dummy cache")
+        key = "notification.tests.throttle"
+        self.addCleanup(caching.cache.delete, key)
+        caching.cache.set(key, 5, 60)
+        incr = caching.incr
+
+        def expire_then_incr(key, delta=1):
+            caching.cache.delete(key)
+            return incr(key, delta)
+
+        caching.incr = expire_then_incr
+        try:
+            self.assertEqual(throttle.count([key], 60), {key: 1})
+        finally:
+            caching.incr = incr
+        self.assertEqual(caching.cache.get(key), 1)
+
+    def test_count_locally(self):
+        cache = caching.cache
+        caching.cache = DummyCache("notification.tests", {})
+        try:
+            self.assertEqual(throttle.count(["a", "b"], 60), {"a": 1, "b": 1})
+            self.assertEqual(throttle.count(["a"], 60), {"a": 2})
+        finally:
+            caching.cache = cache
+
+    def test_count_locally_when_the_cache_fails(self):
+        def fail(*args, **kwargs):
+            raise IOError("cache server is down")
+
+        self.addCleanup(delattr, caching.cache, "add")
+        caching.cache.add = fail
+        self.assertEqual(throttle.count(["a"], 60), {"a": 1})
+        self.assertEqual(throttle.count(["a"], 60), {"a": 2})
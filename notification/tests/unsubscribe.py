@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.signing import Signer
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+
+from notification import models as notification
+from notification.backends.email import unsubscribe_headers
+
+
+class UnsubscribeTest(TestCase):
+    urls = "notification.urls"
+
+    def setUp(self):
+        if "email" not in [label for medium_id, label in notification.NOTICE_MEDIA]:
+            self.skipTest("the email backend is not installed")
+        self.user = User.objects.create_user("reader", "reader@example.com")
+        self.domain = Site.objects.get_current().domain
+        scheme = notification.UNSUBSCRIBE_SCHEME
+        self.addCleanup(setattr, notification, "UNSUBSCRIBE_SCHEME", scheme)
+
+    def one_click_url(self, code=None, medium="email"):
+        code = code or Signer().sign(self.user.pk)
+        return reverse("notification_one_click_unsubscribe", args=[medium, code])
+
+    def is_muted(self):
+        return notification.NoticeMute.objects.filter(user=self.user).exists()
+
+    def test_links(self):
+        page, one_click = notification.get_unsubscribe_links(self.user)
+        self.assertEqual(one_click, "https://%s%s" % (self.domain, self.one_click_url()))
+        self.assertTrue(page.startswith("https://%s/" % self.domain))
+        notification.UNSUBSCRIBE_SCHEME = "http"
+        page, one_click = notification.get_unsubscribe_links(self.user)
+        self.assertEqual(one_click, "http://%s%s" % (self.domain, self.one_click_url()))
+
+    def test_headers(self):
+        page, one_click = notification.get_unsubscribe_links(self.user)
+        self.assertEqual(unsubscribe_headers({"one_click_unsubscribe_link": one_click}), {
+            "List-Unsubscribe": "<https://%s%s>" % (self.domain, self.one_click_url()),
+            "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
+        })
+        self.assertEqual(unsubscribe_headers({}), {})
+
+    def test_one_click(self):
+        # mail providers post without a csrf token nor a session
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(self.one_click_url(), "List-Unsubscribe=One-Click",
+                               content_type="application/x-www-form-urlencoded")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, "")
+        self.assertTrue(self.is_muted())
+
+    def test_one_click_post_only(self):
+        # link checkers and previews GET the url, they must not unsubscribe
+        self.assertEqual(self.client.get(self.one_click_url()).status_code, 405)
+        self.assertFalse(self.is_muted())
+
+    def test_one_click_bad_code(self):
+        for code in ("%s:tampered" % self.user.pk, Signer().sign(self.user.pk + 1)):
+            self.assertEqual(self.client.post(self.one_click_url(code)).status_code, 404)
+        self.assertEqual(self.client.post(self.one_click_url(medium="pigeon")).status_code, 404)
+        self.assertFalse(self.is_muted())
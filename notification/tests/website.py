@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.core.cache.backends.dummy import DummyCache
+from django.test import TestCase
+
+from notification import caching
+from notification import models as notification
+from notification.backends import website
+
+
+class WebsiteDeliveryTest(TestCase):
+
+    def setUp(self):
+        if notification.website is None:
+            self.skipTest("the website backend is not installed")
+        self.backend = notification.website
+        self.sender = User.objects.create_user("sender", "sender@example.com")
+        self.users = [User.objects.create_user("user%s" % i, "user%s@example.com" % i)
+                      for i in range(5)]
+        self.notice_type = notification.NoticeType.objects.create(
+            label="comment", display="Comment", description="a comment", default=2)
+        chunk_size = website.BULK_CHUNK_SIZE
+        website.BULK_CHUNK_SIZE = 2
+        self.addCleanup(setattr, website, "BULK_CHUNK_SIZE", chunk_size)
+
+    def deliver(self, context):
+        return self.backend.deliver_many(self.users, self.sender, self.notice_type, context)
+
+    def assertIdsMatch(self, notices, context):
+        self.assertEqual(sorted(notices), sorted(user.pk for user in self.users))
+        for user_id, notice in notices.items():
+            saved = website.Notice.objects.get(pk=notice.pk)
+            self.assertEqual(saved.recipient_id, user_id)
+            self.assertEqual(saved.data, context)
+
+    def test_ids_map_to_recipients(self):
+        context = {"comment": "first"}
+        self.assertIdsMatch(self.deliver(context), context)
+        self.assertEqual(website.Notice.objects.count(), len(self.users))
+
+    def test_concurrent_send(self):
+        # another send of the same type about the same sender inserts its
+        # notices between this send's insert and the read back of its ids
+        bulk_create = website.Notice.objects.bulk_create
+        other = {"comment": "second"}
+
+        def bulk_create_then_other_send(objs):
+            bulk_create(objs)
+            website.Notice.objects.bulk_create([
+                website.Notice(recipient_id=n.recipient_id, notice_type=self.notice_type,
+                               content_type=n.content_type, object_id=self.sender.pk,
+                               data=other)
+                for n in objs])
+
+        website.Notice.objects.bulk_create = bulk_create_then_other_send
+        try:
+            context = {"comment": "first"}
+            notices = self.deliver(context)
+        finally:
+            del website.Notice.objects.bulk_create
+        self.assertIdsMatch(notices, context)
+        self.assertEqual(website.Notice.objects.filter(data=other).count(), len(self.users))
+
+
+class UnseenCountTest(TestCase):
+
+    def setUp(self):
+        if notification.website is None:
+            self.skipTest("the website backend is not installed")
+        self.user = User.objects.create_user("reader", "reader@example.com")
+        self.addCleanup(website.reset_unseen_count, self.user.pk)
+        website.reset_unseen_count(self.user.pk)
+        notice_type = notification.NoticeType.objects.create(
+            label="comment", display="Comment", description="a comment", default=2)
+        notification.website.deliver_many([self.user] * 3, self.user, notice_type, {})
+        self.notices = list(website.Notice.objects.filter(recipient=self.user))
+
+    def count(self):
+        return website.Notice.objects.cached_unseen_count_for(self.user)
+
+    def test_archive(self):
+        self.assertEqual(self.count(), 3)
+        self.notices[0].archive()
+        self.assertEqual(self.count(), 2)
+
+    def test_archive_seen(self):
+        if isinstance(caching.cache, DummyCache):
+            self.skipTest("NOTIFICATION_CACHE is a dummy cache")
+        notice = self.notices[0]
+        notice.unseen = False
+        notice.save()
+        website.reset_unseen_count(self.user.pk)
+        self.assertEqual(self.count(), 2)
+        notice.archive()
+        # the count did not change, it is still cached
+        self.assertEqual(caching.cache.get(website.unseen_count_key(self.user.pk)), 2)
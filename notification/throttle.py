@@ -0,0 +1,152 @@
+'''
+Throttling of repeated notices: the same notice type about the same sender
+sent to the same user again and again (a busy comment thread, a loop calling
+send...).
+
+Every backend (label) is throttled on its own so, for example, website
+notices can keep being recorded while email is throttled. Repeats are counted
+per (backend, recipient, notice type, sender) in the app cache (see
+notification.caching), or in a per process cache when the app cache is a
+dummy cache or fails.
+
+NOTIFICATION_THROTTLE( = {}) {label: {"window": seconds, "limit": n,
+"policy": policy}}: within window seconds of the first notice a user gets at
+most limit (default 1) of them through that backend, the others are handled
+according to policy:
+ - "drop" (default): discarded.
+ - "collapse": website only (other backends drop them), counted on the
+   user's unarchived notice of the window (Notice.occurrences), which
+   becomes unseen again.
+ - "delay": queued to be sent through that backend only once the window has
+   passed (by the emit_notices command). The delayed notices are sent
+   without being counted again, so they are never delayed twice.
+Backends without an entry and notices without a saved sender are never
+throttled.
+NOTIFICATION_THROTTLE_LOCAL_SIZE( = 10000) number of counters kept by the per
+process fallback.
+'''
+# Python Core
+import logging
+import threading
+import time
+
+# Django
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache.backends.dummy import DummyCache
+
+# This app
+from notification import caching
+
+DROP = "drop"
+COLLAPSE = "collapse"
+DELAY = "delay"
+
+THROTTLE = getattr(settings, "NOTIFICATION_THROTTLE", {})
+LOCAL_SIZE = getattr(settings, "NOTIFICATION_THROTTLE_LOCAL_SIZE", 10000)
+
+logger = logging.getLogger("notification")
+
+local = caching.LocalCache(LOCAL_SIZE, 0)
+_local_lock = threading.Lock()
+
+
+def get_policy(label):
+    '''
+    Returns the (window, limit, policy) of backend label, None if it is not
+    throttled.
+    '''
+    config = THROTTLE.get(label)
+    if not config:
+        return None
+    return config["window"], config.get("limit", 1), config.get("policy", DROP)
+
+
+def throttle_key(label, user_id, notice_type_id, content_type_id, object_id):
+    return "notification.throttle.%s.%s.%s.%s.%s" % (label, user_id, notice_type_id,
+                                                     content_type_id, object_id)
+
+
+def _count_local(keys, window):
+    counts = {}
+    with _local_lock:
+        for key in keys:
+            # the expiry is kept so the window does not slide
+            expires, count = local.get(key) or (time.time() + window, 0)
+            counts[key] = count + 1
+            local.set(key, (expires, count + 1), expires - time.time())
+    return counts
+
+
+def _count_cached(keys, window):
+    counts = {}
+    for key in keys:
+        # add is atomic: of concurrent sends only one starts the window
+        if caching.cache.add(key, 1, window):
+            counts[key] = 1
+            continue
+        count = caching.incr(key)
+        if count is None:
+            # expired between add and incr, this notice starts a new window
+            caching.cache.add(key, 1, window)
+            count = 1
+        counts[key] = count
+    return counts
+
+
+def count(keys, window):
+    '''
+    Adds one to the counters of keys, started with a lifetime of window
+    seconds. Returns {key: count}.
+    '''
+    if isinstance(caching.cache, DummyCache):
+        return _count_local(keys, window)
+    try:
+        return _count_cached(keys, window)
+    except Exception:
+        logger.exception("notification throttle cache failed, counting locally")
+        return _count_local(keys, window)
+
+
+def check(label, users, notice_type, sender):
+    '''
+    Counts one more notice of notice_type about sender for every user through
+    backend label. Returns (allowed, repeated): the users within the limit and
+    the others, in the order given.
+    '''
+    config = get_policy(label)
+    if config is None or not users or getattr(sender, "_meta", None) is None or sender.pk is None:
+        return list(users), []
+    window, limit, policy = config
+    content_type = ContentType.objects.get_for_model(sender)
+    keys = [throttle_key(label, user.pk, notice_type.pk, content_type.pk, sender.pk)
+            for user in users]
+    counts = count(keys, window)
+    allowed = []
+    repeated = []
+    for user, key in zip(users, keys):
+        if counts[key] > limit:
+            repeated.append(user)
+        else:
+            allowed.append(user)
+    return allowed, repeated
+
+
+def apply(label, users, notice_type, sender, extra_context):
+    '''
+    Throttles the users about to be sent notice_type through backend label.
+    Handles the repeats according to the backend's policy and returns the
+    users to send it to now.
+    '''
+    allowed, repeated = check(label, users, notice_type, sender)
+    if not repeated:
+        return allowed
+    window, limit, policy = get_policy(label)
+    if policy == COLLAPSE and label == "website":
+        from notification.backends.website import collapse_repeats
+        collapse_repeats(repeated, notice_type, sender, window)
+    elif policy == DELAY:
+        from notification.models import queue
+        queue(repeated, notice_type.label, extra_context, sender=sender,
+              media=[label], delay=window, throttled=False)
+    return allowed
@@ -1,8 +1,10 @@
 # Python Core
 from datetime import datetime, timedelta
+import calendar
 import json
 
 # Django
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.core.signing import Signer, BadSignature
 from django.contrib.auth.models import User
@@ -15,19 +17,84 @@ from django.core.urlresolvers import resolve, Resolver404
 
 # Django Apps
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils import timezone
 
 # This app
 #FIXME dinamically import this
-from notification.backends.website import Notice
+from notification.backends.website import Notice, reset_unseen_count, render_many
 from notification.models import (NoticeType, NoticeSetting, NOTICE_MEDIA,
-                                 get_notification_setting)
+                                 get_notice_types, get_user_notice_settings,
+                                 set_user_notice_settings, unsubscribe_user,
+                                 NOTIFICATION_BACKENDS, FREQUENCIES,
+                                 DIGEST_FREQUENCIES, IMMEDIATE)
+
+'''
+NOTIFICATION_PAGE_SIZE( = 50) number of notices per page in the notices views.
+'''
+PAGE_SIZE = getattr(settings, "NOTIFICATION_PAGE_SIZE", 50)
+
+
+def encode_cursor(notice):
+    """
+    Position of a notice in the (added, id) ordering, as an url parameter.
+    """
+    added = notice.added
+    if timezone.is_aware(added):
+        seconds = calendar.timegm(added.utctimetuple())
+    else:
+        seconds = calendar.timegm(added.timetuple())
+    return "%d%06d-%d" % (seconds, added.microsecond, notice.id)
+
+
+def decode_cursor(cursor):
+    """
+    Reverse of encode_cursor. Returns (added, id) or None for invalid cursors.
+    """
+    try:
+        timestamp, id = cursor.split("-")
+        added = datetime.utcfromtimestamp(int(timestamp[:-6]))\
+                        .replace(microsecond=int(timestamp[-6:]))
+        id = int(id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    if settings.USE_TZ:
+        added = added.replace(tzinfo=timezone.utc)
+    return added, id
+
+
+def paginate_notices(notices, cursor=None, page_size=PAGE_SIZE):
+    """
+    Keyset pagination of a Notice queryset, newest first. Only the requested
+    page is read, so the cost does not depend on the size of the inbox.
+    Returns (page, next_cursor), next_cursor being None on the last page.
+    """
+    notices = notices.order_by("-added", "-id")
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        added, id = position
+        notices = notices.filter(Q(added__lt=added) | Q(added=added, id__lt=id))
+    page = list(notices[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(page[-1])
+    return page, next_cursor
+
 
 @login_required
 def notices(request, alln=False, archived=False):
     """
     The main notices index view.
+
+    Notices are paginated with the ``before`` GET parameter, the cursor of
+    the last notice shown (see paginate_notices).
     """
-    notices = Notice.objects.notices_for(request.user, archived)
+    notices = Notice.objects.notices_for(request.user, archived)\
+                            .select_related("notice_type", "content_type")
+    cursor = request.GET.get("before")
+    page_size = PAGE_SIZE
     
     # TODO:for date grouper but i'm sure there is a better way.
     this_month = datetime.now().strftime("%B %Y")
@@ -36,18 +103,25 @@ def notices(request, alln=False, archived=False):
     
     week_ago = datetime.now() - timedelta(weeks=1)
 
+    # recent notices only, on every page: the cursor pages through the same set
     if not alln:
         old = datetime.now() - timedelta(days=3)
         latest_notices = notices.filter(Q(unseen=True) |
                                         Q(added__gt=old))
 
-        if len(latest_notices) < 10:
-            latest_notices = notices.filter()[:10]
+        if len(latest_notices.values_list("id")[:10]) < 10:
+            latest_notices = notices
+            page_size = 10
 
         notices = latest_notices
-    
+
+    notices, next_cursor = paginate_notices(notices, cursor, page_size)
+    # {{ notice.render }} in the template then costs nothing
+    render_many(notices)
+
     return render_to_response("notification/notices.html", {
         "notices": notices,
+        "next_cursor": next_cursor,
         "archived": archived,
         'all': alln,
         'this_month': this_month,
@@ -56,6 +130,52 @@ def notices(request, alln=False, archived=False):
         'week_ago': week_ago,
     }, context_instance=RequestContext(request))
 
+@login_required
+def notices_feed(request):
+    """
+    The notices of the requesting user as json, for xhr and mobile clients.
+
+    GET parameters:
+
+        before
+            cursor returned as ``next`` by the previous page
+        archived
+            ``1`` for archived notices
+        unseen
+            ``1`` only unseen notices, ``0`` only seen notices
+        render
+            ``0`` to skip the rendered ``html`` (the notice data is then not
+            loaded at all)
+    """
+    archived = request.GET.get("archived") == "1"
+    unseen = {"1": True, "0": False}.get(request.GET.get("unseen"))
+    render = request.GET.get("render") != "0"
+    notices = Notice.objects.notices_for(request.user, archived, unseen)\
+                            .select_related("notice_type", "content_type")
+    if not render:
+        notices = notices.defer("data")
+    page, next_cursor = paginate_notices(notices, request.GET.get("before"))
+    if render:
+        render_many(page)
+
+    items = []
+    for notice in page:
+        item = {
+            "id": notice.id,
+            "added": notice.added.isoformat(),
+            "unseen": notice.unseen,
+            "archived": notice.archived,
+            "notice_type": notice.notice_type.label,
+            "display": notice.notice_type.display,
+            "sender_type": notice.content_type.name,
+            "object_id": notice.object_id,
+        }
+        if render:
+            item["html"] = notice.render()
+        items.append(item)
+    return HttpResponse(json.dumps({"notices": items, "next": next_cursor}),
+                        content_type='application/json')
+
 @login_required
 def notice_settings(request):
     """
@@ -74,38 +194,52 @@ def notice_settings(request):
             :model:`notification.NoticeType` object and ``cells``, a list of
             tuples whose first value is suitable for use in forms and the second
             value is ``True`` or ``False`` depending on a ``request.POST``
-            variable called ``form_label``, whose valid value is ``on``.
+            variable called ``form_label``, whose valid value is ``on``. The
+            third value is the frequency (``immediate``, ``hourly`` or
+            ``daily``, posted as ``form_label``_frequency) for media supporting
+            digests, else ``None``.
+
+        frequencies
+            The ``FREQUENCIES`` choices.
     """
-    notice_types = NoticeType.objects.all()
+    notice_types = sorted(get_notice_types().values(), key=lambda nt: nt.id)
+    user_settings = get_user_notice_settings(request.user)
     settings_table = []
-    changed = False
+    changes = {}
     settings_data = []
     for notice_type in notice_types:
         settings_row = []
-        for medium_id, medium_display in NOTICE_MEDIA:
+        for medium in NOTICE_MEDIA:
+            medium_id = medium[0]
             form_label = "%s_%s" % (notice_type.label, medium_id)
-            setting = get_notification_setting(request.user,
-                                               notice_type,
-                                               medium_id)
+            key = (notice_type.id, str(medium_id))
+            send = user_settings[key]
             if request.method == "POST":
-                print form_label, request.POST.get(form_label, "not_found")
-                if request.POST.get(form_label) == "on":
-                    if not setting.send:
-                        setting.send = True
-                        setting.save()
-                        changed = True
-                else:
-                    if setting.send:
-                        setting.send = False
-                        setting.save()
-                        changed = True
-            settings_row.append((form_label, setting.send))
+                posted = request.POST.get(form_label) == "on"
+                if posted:
+                    # keep the current frequency unless another one is posted
+                    frequency = request.POST.get(form_label + "_frequency")
+                    if frequency == IMMEDIATE:
+                        posted = True
+                    elif frequency in DIGEST_FREQUENCIES:
+                        posted = frequency
+                    elif send:
+                        posted = send
+                if posted != send:
+                    changes[key] = send = posted
+            # the third value is the digest frequency for media supporting it
+            if NOTIFICATION_BACKENDS[medium].supports_digest:
+                frequency = send if send in DIGEST_FREQUENCIES else IMMEDIATE
+            else:
+                frequency = None
+            settings_row.append((form_label, bool(send), frequency))
         #use to determin if a notice_type is from the system or a system user
         notice_type.is_system = notice_type.label.find('system')+1
         settings_table.append({"notice_type": notice_type, "cells": settings_row})
         settings_data.append({"notice_type": notice_type.label, "cells": settings_row})
 
-    if changed:
+    if changes:
+        set_user_notice_settings(request.user, changes)
         messages.add_message(request, messages.INFO, "Notification settings updated.")
 
     if request.method == "POST":
@@ -123,6 +257,7 @@ def notice_settings(request):
     return render_to_response("notification/notice_settings.html", {
         "notice_types": notice_types,
         "notice_settings": notice_settings,
+        "frequencies": FREQUENCIES,
     }, context_instance=RequestContext(request))
 
 
@@ -149,6 +284,7 @@ def single(request, id, mark_seen=True):
         if mark_seen and notice.unseen:
             notice.unseen = False
             notice.save()
+            reset_unseen_count(notice.recipient_id)
         return render_to_response("notification/single.html", {
             "notice": notice,
         }, context_instance=RequestContext(request))
@@ -176,6 +312,7 @@ def view_sender(request, id, sender_url=None, mark_seen=True):
         if mark_seen and notice.unseen:
             notice.unseen = False
             notice.save()
+            reset_unseen_count(notice.recipient_id)
         if not sender_url:
             sender_url = request.REQUEST.get('sender_url',None)
             try:
@@ -220,9 +357,10 @@ def toggle_archived(request, noticeid=None, next_page=None):
                 if notice.archived:
                     notice.archived = False
                     notice.save()
+                    if notice.unseen:
+                        reset_unseen_count(notice.recipient_id)
                 else:
-                    notice.archived = True
-                    notice.save()
+                    notice.archive()
             else:   # you can archive other users' notices
                     # only if you are superuser.
                 return HttpResponseRedirect(next_page)
@@ -253,6 +391,7 @@ def delete(request, noticeid=None, next_page=None):
             notice = Notice.objects.get(id=noticeid)
             if request.user == notice.recipient or request.user.is_superuser:
                 notice.delete()
+                reset_unseen_count(notice.recipient_id)
             else:   # you can delete other users' notices
                     # only if you are superuser.
                 return HttpResponseRedirect(next_page)
@@ -289,6 +428,7 @@ def toggle_unseen(request, noticeid=None, next_page=None):
                 else:
                     notice.unseen = True
                     notice.save()
+                reset_unseen_count(notice.recipient_id)
             else:   # you can delete other users' notices
                     # only if you are superuser.
                 return HttpResponseRedirect(next_page)
@@ -302,7 +442,11 @@ def toggle_all(request, next_page=None):
     """
     Toggles: delete, archived, & unseen as checked in form: model:`notices.Notice` if the requesting user is the recipient
     or if the user is a superuser.  Returns a ``HttpResponseRedirect`` when
-    complete.
+    complete, or the number of notices changed per action as json for ajax
+    requests.
+
+    One UPDATE is run per (action, value) and one DELETE for all the posted
+    notices, whatever their number.
 
     Optional arguments:
         next_page
@@ -311,38 +455,44 @@ def toggle_all(request, next_page=None):
     """
     if not next_page:
         next_page = request.META['HTTP_REFERER']
-    notices = {}
+    # posted variables are named <notice id>-<action>
+    updates = {}
+    delete_ids = set()
     for var in request.POST:
         if var != 'csrfmiddlewaretoken':
             svar = var.split('-')
-            id = svar[0]
-            action = svar[1]
+            if len(svar) != 2 or not svar[0].isdigit():
+                continue
+            id, action = int(svar[0]), svar[1]
             value = request.POST[var]
             if value == 'True': value = True
             if value == 'False': value = False
-            if not notices.get(id, False):
-                notices[id] = {action:value}
-            else:
-               notices[id].update({action:value})
-    for notice_id in notices:
-        try:
-            notice = Notice.objects.get(id=notice_id)
-            if request.user == notice.recipient or request.user.is_superuser:
-                if notices[notice_id].get('unseen', None) != None and notice.unseen != notices[notice_id]['unseen']:
-                    notice.unseen = notices[notice_id]['unseen']
-                    notice.save()
-                if notices[notice_id].get('archived', None) != None and notice.archived != notices[notice_id]['archived']:
-                    notice.archived = notices[notice_id]['archived']
-                    notice.save()
-                if notices[notice_id].get('delete', None) != None and notices[notice_id]['delete']:
-                    notice.delete()
-                
-            else:   # you can delete other users' notices
-                    # only if you are superuser.
-                return HttpResponseRedirect(next_page)
-        except Notice.DoesNotExist:
-            return HttpResponseRedirect(next_page)
+            if action == 'delete':
+                if value:
+                    delete_ids.add(id)
+            elif action in ('unseen', 'archived') and value in (True, False):
+                updates.setdefault((action, value), set()).add(id)
+
+    # you can change other users' notices only if you are superuser.
+    notices = Notice.objects.all()
+    if not request.user.is_superuser:
+        notices = notices.filter(recipient=request.user)
+    posted = delete_ids.union(*updates.values())
+    recipients = set(notices.filter(pk__in=posted).values_list('recipient', flat=True))
+
+    counts = {}
+    for (action, value), ids in updates.items():
+        ids = ids - delete_ids
+        if ids:
+            counts['%s_%s' % (action, value)] = notices.filter(pk__in=ids)\
+                                                       .update(**{action: value})
+    if delete_ids:
+        counts['deleted'] = notices.filter(pk__in=delete_ids).count()
+        notices.filter(pk__in=delete_ids).delete()
+    reset_unseen_count(*recipients)
 
+    if request.is_ajax():
+        return HttpResponse(json.dumps(counts), content_type='application/json')
     return HttpResponseRedirect(next_page)
 
 
@@ -350,16 +500,22 @@ def toggle_all(request, next_page=None):
 def mark_all_seen(request):
     """
     Mark all unseen notices for the requesting user as seen.  Returns a
-    ``HttpResponseRedirect`` when complete. 
+    ``HttpResponseRedirect`` when complete, or ``{"seen": count}`` as json
+    for ajax requests.
     """
 
-    for notice in Notice.objects.notices_for(request.user, unseen=True):
-        notice.unseen = False
-        notice.save()
+    count = Notice.objects.mark_all_seen(request.user)
+    if request.is_ajax():
+        return HttpResponse(json.dumps({'seen': count}),
+                            content_type='application/json')
     return HttpResponseRedirect(request.META['HTTP_REFERER'])
 
 
-def unsubscribe(request, medium, code):
+def _unsubscribe(medium, code):
+    '''
+    Unsubscribes the user signed in code from medium (a backend label) and
+    returns the user. Raises Http404 for bad codes or media.
+    '''
     signer = Signer()
     try:
         user = User.objects.get(id=signer.unsign(code))
@@ -367,9 +523,12 @@ def unsubscribe(request, medium, code):
     except (BadSignature, User.DoesNotExist, IndexError):
         raise Http404
 
-    for ns in NoticeSetting.objects.filter(user=user, medium=medium_code):
-        ns.send = False
-        ns.save()
+    unsubscribe_user(user, medium_code)
+    return user
+
+
+def unsubscribe(request, medium, code):
+    user = _unsubscribe(medium, code)
 
     if medium == 'email':
         ctx = {'message': """Your email address (%s) will no longer receive any
@@ -377,6 +536,17 @@ def unsubscribe(request, medium, code):
 
     return render(request, 'notification/unsubscribed.html', ctx)
 
+
+@csrf_exempt
+@require_POST
+def one_click_unsubscribe(request, medium, code):
+    """
+    RFC 8058 one click unsubscribe, POSTed to by mail providers with
+    ``List-Unsubscribe=One-Click`` as body. Renders nothing.
+    """
+    _unsubscribe(medium, code)
+    return HttpResponse("", content_type="text/plain")
+
 from django.contrib.contenttypes.models import ContentType
 from notification.models import Observation, is_observing
 @login_required